@@ -0,0 +1,129 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Clock of the latency measurements
+
+The timers read CLOCK_MONOTONIC, which NTP can't step in the middle of
+a run the way it can time.time(). python 2 has no time.monotonic, so
+clock_gettime is called through ctypes (about 0.7 usec a call), and
+time.time() is the last resort where that fails.
+
+The kvm events are timestamped by the ftrace clock instead. TraceClock
+writes markers holding the monotonic time to trace_marker, ftrace
+timestamps them like the events, which gives the offset between the
+two clocks at each marker.
+"""
+
+import os, time, threading, ctypes, ctypes.util
+
+TRACE_MARKER = "/sys/kernel/debug/tracing/trace_marker"
+
+# tag of the calibration markers, e.g.
+# "zk-latencies-2310 [001] ....  5129.307541: tracing_mark_write: zk_clock begin created 5129302188004"
+MARKER = "zk_clock"
+
+CLOCK_MONOTONIC = 1
+
+class timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+def libc_clock():
+    """now() and now_ns() reading CLOCK_MONOTONIC through ctypes, None
+    if clock_gettime isn't there"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    # the call releases the GIL, each thread has a timespec of its own
+    local = threading.local()
+
+    def timespec_now():
+        try:
+            ts, ref = local.ts
+        except AttributeError:
+            ts = timespec()
+            ref = ctypes.byref(ts)
+            local.ts = (ts, ref)
+        if clock_gettime(CLOCK_MONOTONIC, ref) != 0:
+            raise OSError("clock_gettime failed")
+        return ts
+
+    def now():
+        ts = timespec_now()
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    def now_ns():
+        ts = timespec_now()
+        return ts.tv_sec * 1000000000 + ts.tv_nsec
+
+    try:
+        now()
+    except OSError:
+        return None
+    return now, now_ns
+
+if hasattr(time, "monotonic_ns"):
+    now, now_ns = time.monotonic, time.monotonic_ns
+    MONOTONIC = True
+else:
+    clocks = libc_clock()
+    MONOTONIC = clocks is not None
+    if MONOTONIC:
+        now, now_ns = clocks
+    else:
+        now = time.time
+        now_ns = lambda: int(time.time() * 1000000000)
+
+class TraceClock(object):
+    """Writes calibration markers to trace_marker
+
+    A marker holds the monotonic time, in ns, read right before the
+    write. ftrace timestamps it during the write, so a parser gets the
+    offset between the ftrace clock and the monotonic clock from the
+    marker, within the time the write took (error_ns is the longest
+    seen). Marking the beginning and end of a phase also gives the
+    drift of the clocks over the phase.
+
+    When trace_marker can't be opened (it is root only) the markers
+    are dropped.
+    """
+    def __init__(self, path=TRACE_MARKER):
+        self.path = path
+        self.error_ns = 0
+        self.marks = 0
+        try:
+            self.fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        except OSError:
+            self.fd = None
+
+    def enabled(self):
+        return self.fd is not None
+
+    def mark(self, label, phase):
+        """write marker "zk_clock label phase ns", returns ns or None"""
+        if self.fd is None:
+            return None
+        before = now_ns()
+        os.write(self.fd, "%s %s %s %d\n" % (MARKER, label, phase, before))
+        self.error_ns = max(self.error_ns, now_ns() - before)
+        self.marks += 1
+        return before
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
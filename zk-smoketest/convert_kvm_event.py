@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# Converts the kvm event traces of each phase (created.txt, set.txt, ...)
+# into binary columnar files (created.kvmb, set.kvmb, ...) that
+# parse_kvm_event.py and plot_event_flows.py memory map instead of
+# parsing the text again.
+#
+# Input
+#       Data get from /sys/kernel/debug/tracing/trace_pipe
+#
+
+import sys, os
+
+from kvmtrace import TraceParser, TraceFormatError, EventSeries, \
+    binary_path, save_binary
+
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('input', nargs='+', help='phase trace files or experiment directories')
+
+parser.add_argument('-e', '--events', action="store",
+                    dest='events',
+                    default='apic_write,apic_read,pio_write',
+                    help='comma separated events to keep (default %(default)s)')
+args = parser.parse_args()
+
+operations = ['created', 'set', 'get', 'deleted',
+              'created_eph', 'watched_eph', 'watchd_eph', 'deleted_eph']
+
+def convert(in_file):
+    trace = TraceParser(with_pid=True)
+    for event in args.events.split(','):
+        trace.register(EventSeries(event))
+    with open(in_file) as fp:
+        try:
+            trace.parse(fp)
+        except TraceFormatError:
+            print "Wrong format: %s" % (in_file)
+            sys.exit()
+
+    out_file = binary_path(in_file)
+    count = save_binary(out_file, trace)
+    print "%s: %d events (%d bytes)" % (out_file, count, os.path.getsize(out_file))
+
+if __name__ == '__main__':
+    for path in args.input:
+        if os.path.isdir(path):
+            for ops in operations:
+                in_file = path + '/' + ops + '.txt'
+                if os.path.exists(in_file):
+                    convert(in_file)
+        else:
+            convert(path)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Correlation of the requests of a zk-latencies.py phase with the kvm
+# exits of its trace
+#
+# Input
+#       <phase>_latencies.txt of zk-latencies.py --dump_latencies, the
+#       start and latency of each request on the monotonic clock, and
+#       the phase trace with its zk_clock calibration markers
+#
+
+import re
+import numpy as np
+
+from kvmtrace import TraceFormatError
+
+# line of a --dump_latencies file, "op start(sec) latency(usec)"
+SAMPLE_PATTERN = re.compile(r'^(\S+) (\d+\.\d+) (\d+)$')
+
+# requests at or above this latency percentile are the slow ones
+SLOW_PERCENTILE = 99.0
+
+class RequestLog(object):
+    """Start and end, in monotonic ns, of the requests of a phase"""
+    def __init__(self, starts, ends):
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def load(cls, in_file):
+        starts = []
+        latencies = []
+        with open(in_file) as fp:
+            for line in fp:
+                m = SAMPLE_PATTERN.match(line.rstrip())
+                if not m:
+                    raise TraceFormatError("Wrong format: %s" % (line.rstrip()))
+                starts.append(m.group(2))
+                latencies.append(m.group(3))
+        # the seconds are parsed as decimals, a double would round the ns
+        starts = np.array([long(s.replace('.', '')) * 1000 for s in starts],
+                          dtype=np.int64)
+        latencies = np.array(latencies, dtype=np.int64) * 1000
+        return cls(starts, starts + latencies)
+
+    def __len__(self):
+        return len(self.starts)
+
+# exits between the start and end of each request
+def overlapping(events, starts, ends):
+    return (np.searchsorted(events, ends, 'right') -
+            np.searchsorted(events, starts, 'left'))
+
+# requests in flight at each event
+def in_flight(events, starts, ends):
+    return (np.searchsorted(np.sort(starts), events, 'right') -
+            np.searchsorted(np.sort(ends), events, 'left'))
+
+def split_shares(events, starts, ends):
+    """Share of the exits of each request, an exit being split evenly
+    between the requests in flight when it happened. Returns the shares
+    and the number of exits with no request in flight."""
+    flight = in_flight(events, starts, ends)
+    weights = np.where(flight > 0, 1.0 / np.maximum(flight, 1), 0.0)
+    cumulative = np.concatenate(([0.0], np.cumsum(weights)))
+    shares = (cumulative[np.searchsorted(events, ends, 'right')] -
+              cumulative[np.searchsorted(events, starts, 'left')])
+    return shares, int(np.sum(flight == 0))
+
+class ExitStats(object):
+    """How the exits of one type line up with the requests
+
+    - exits: exits in the phase, idle: those with no request in flight
+    - per_op: exits attributed to each request, split between the
+      requests in flight
+    - hit: fraction of the requests with at least one exit during them
+    - slow_per_op: per_op of the slow requests only
+    - induced_usec: mean latency of the requests hit by an exit minus
+      that of the requests hit by none, in usec. Longer requests are
+      more likely to be hit, so with many requests in flight this is
+      an upper bound of the latency the exits add.
+    """
+    def __init__(self, event, events, starts, ends, slow):
+        # starts and ends of the requests in trace usec, like the events
+        latencies = ends - starts
+        shares, self.idle = split_shares(events, starts, ends)
+        hits = overlapping(events, starts, ends) > 0
+        self.event = event
+        self.exits = len(events)
+        self.per_op = shares.mean() if len(shares) else 0.0
+        self.hit = hits.mean() if len(hits) else 0.0
+        self.slow_per_op = shares[slow].mean() if slow.any() else 0.0
+        self.induced_usec = None
+        if hits.any() and not hits.all():
+            self.induced_usec = latencies[hits].mean() - latencies[~hits].mean()
+
+class Correlation(object):
+    """The exits of the series of a parsed phase trace correlated with
+    the requests of a RequestLog, on the trace clock"""
+    def __init__(self, requests, trace, series):
+        sync = trace.clock_sync()
+        if sync is None:
+            raise TraceFormatError("no zk_clock markers to line the requests up with the trace")
+        self.requests = len(requests)
+        starts = sync.to_trace_usec(requests.starts)
+        ends = sync.to_trace_usec(requests.ends)
+        latencies = ends - starts
+        self.slow_usec = 0
+        slow = np.zeros(len(latencies), dtype=bool)
+        if len(latencies):
+            self.slow_usec = np.percentile(latencies, SLOW_PERCENTILE)
+            slow = latencies >= self.slow_usec
+        self.slow = int(slow.sum())
+        self.drift_ns = sync.drift()
+        self.stats = [ExitStats(s.pattern, s.events, starts, ends, slow)
+                      for s in series]
+
+    def report(self):
+        """lines of the per op table"""
+        lines = ['\t%d requests, %d slow ones at or above p%g %.3f ms, clock drift %d usec'
+                 % (self.requests, self.slow, SLOW_PERCENTILE,
+                    self.slow_usec / 1000.0, self.drift_ns // 1000),
+                 '\t%-12s %9s %9s %10s %7s %13s %13s'
+                 % ('event', 'exits', 'idle', 'exits/op', 'hit %',
+                    'exits/slow op', 'induced usec')]
+        for s in self.stats:
+            induced = '-'
+            if s.induced_usec is not None:
+                induced = '%.1f' % (s.induced_usec)
+            lines.append('\t%-12s %9d %9d %10.3f %7.1f %13.3f %13s'
+                         % (s.event, s.exits, s.idle, s.per_op,
+                            100.0 * s.hit, s.slow_per_op, induced))
+        return lines
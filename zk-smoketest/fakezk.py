@@ -0,0 +1,359 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process stand-in for the zookeeper C binding
+
+Implements the part of the zookeeper module used by zkclient: the
+sync, async and watch calls on one in-memory tree shared by every
+handle. Each handle has a thread that completes its requests in order
+after an injected latency and runs the completions and watchers, like
+the completion thread of the C client.
+
+The latency is FAKEZK_LATENCY_MS from the environment or set_latency().
+The tree lives in the process, forked processes each get their own.
+"""
+
+import os, sys, time, threading, collections
+
+from zkconst import *
+
+# set() is shadowed by the zookeeper set call below
+set_type = set
+
+latency = float(os.environ.get('FAKEZK_LATENCY_MS', 0)) / 1000.0
+
+def set_latency(ms):
+    """Injected latency of each request in milliseconds"""
+    global latency
+    latency = ms / 1000.0
+
+def set_log_stream(stream):
+    pass
+
+def set_debug_level(level):
+    pass
+
+class Node(object):
+    def __init__(self, data, owner, zxid):
+        self.data = data
+        self.owner = owner
+        self.children = set_type()
+        self.czxid = zxid
+        self.mzxid = zxid
+        self.ctime = int(time.time() * 1000)
+        self.mtime = self.ctime
+        self.version = 0
+        self.cversion = 0
+        self.seq = 0
+
+    def stat(self):
+        return {'czxid': self.czxid, 'mzxid': self.mzxid,
+                'ctime': self.ctime, 'mtime': self.mtime,
+                'version': self.version, 'cversion': self.cversion,
+                'aversion': 0, 'ephemeralOwner': self.owner,
+                'dataLength': len(self.data),
+                'numChildren': len(self.children), 'pzxid': self.mzxid}
+
+class Tree(object):
+    """The znodes and the watches registered on them"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {'/': Node("", 0, 0)}
+        self.zxid = 0
+        self.data_watches = collections.defaultdict(list)
+        self.exist_watches = collections.defaultdict(list)
+        self.child_watches = collections.defaultdict(list)
+
+    def parent(self, path):
+        return path.rsplit('/', 1)[0] or '/'
+
+    def fire(self, triggered, typ, path):
+        for session, watcher in triggered:
+            session.post(watcher, (session.handle, typ, CONNECTED_STATE, path))
+
+    def watch(self, watches, session, path, watcher):
+        if watcher is not None and (session, watcher) not in watches[path]:
+            watches[path].append((session, watcher))
+
+    def create(self, session, path, data, flags):
+        parent = self.parent(path)
+        if parent not in self.nodes:
+            return NONODE, None
+        if self.nodes[parent].owner:
+            return NOCHILDRENFOREPHEMERALS, None
+        if flags & SEQUENCE:
+            path = "%s%010d" % (path, self.nodes[parent].seq)
+        if path in self.nodes:
+            return NODEEXISTS, None
+        self.zxid += 1
+        owner = flags & EPHEMERAL and session.handle or 0
+        self.nodes[path] = Node(data, owner, self.zxid)
+        pnode = self.nodes[parent]
+        pnode.children.add(path.rsplit('/', 1)[1])
+        pnode.cversion += 1
+        pnode.seq += 1
+        if owner:
+            session.ephemerals.add(path)
+        self.fire(self.exist_watches.pop(path, []), CREATED_EVENT, path)
+        self.fire(self.child_watches.pop(parent, []), CHILD_EVENT, parent)
+        return OK, path
+
+    def delete(self, session, path, version):
+        node = self.nodes.get(path)
+        if node is None:
+            return NONODE
+        if version != -1 and version != node.version:
+            return BADVERSION
+        if node.children:
+            return NOTEMPTY
+        self.zxid += 1
+        del self.nodes[path]
+        parent = self.parent(path)
+        pnode = self.nodes[parent]
+        pnode.children.discard(path.rsplit('/', 1)[1])
+        pnode.cversion += 1
+        if node.owner:
+            for s in sessions.values():
+                s.ephemerals.discard(path)
+        self.fire(self.data_watches.pop(path, []) +
+                  self.exist_watches.pop(path, []) +
+                  self.child_watches.pop(path, []), DELETED_EVENT, path)
+        self.fire(self.child_watches.pop(parent, []), CHILD_EVENT, parent)
+        return OK
+
+    def set(self, session, path, data, version):
+        node = self.nodes.get(path)
+        if node is None:
+            return NONODE, None
+        if version != -1 and version != node.version:
+            return BADVERSION, None
+        self.zxid += 1
+        node.data = data
+        node.version += 1
+        node.mzxid = self.zxid
+        node.mtime = int(time.time() * 1000)
+        self.fire(self.data_watches.pop(path, []) +
+                  self.exist_watches.pop(path, []), CHANGED_EVENT, path)
+        return OK, node.stat()
+
+    def get(self, session, path, watcher):
+        node = self.nodes.get(path)
+        if node is None:
+            return NONODE, None, None
+        self.watch(self.data_watches, session, path, watcher)
+        return OK, node.data, node.stat()
+
+    def exists(self, session, path, watcher):
+        node = self.nodes.get(path)
+        if node is None:
+            self.watch(self.exist_watches, session, path, watcher)
+            return NONODE, None
+        self.watch(self.data_watches, session, path, watcher)
+        return OK, node.stat()
+
+    def get_children(self, session, path, watcher):
+        node = self.nodes.get(path)
+        if node is None:
+            return NONODE, None
+        self.watch(self.child_watches, session, path, watcher)
+        return OK, sorted(node.children)
+
+    def expire(self, session):
+        for path in sorted(session.ephemerals, reverse=True):
+            self.delete(session, path, -1)
+        for watches in (self.data_watches, self.exist_watches, self.child_watches):
+            for path in watches.keys():
+                watches[path] = [w for w in watches[path] if w[0] is not session]
+                if not watches[path]:
+                    del watches[path]
+
+tree = Tree()
+sessions = {}
+next_handle = [0]
+
+class Session(object):
+    """A handle, its requests are completed in submission order by
+    its own thread once their injected latency is over"""
+    def __init__(self, handle, watcher):
+        self.handle = handle
+        self.watcher = watcher
+        self.ephemerals = set_type()
+        self.cv = threading.Condition()
+        self.requests = collections.deque()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run,
+                                       name="fakezk-%d" % (handle))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, op, args, completion):
+        self.cv.acquire()
+        if self.closed:
+            self.cv.release()
+            raise err_to_exception(INVALIDSTATE)
+        self.requests.append((time.time() + latency, op, args, completion))
+        self.cv.notify()
+        self.cv.release()
+
+    def post(self, func, args):
+        """run func(*args) on the completion thread"""
+        self.cv.acquire()
+        self.requests.append((0, None, func, args))
+        self.cv.notify()
+        self.cv.release()
+
+    def run(self):
+        while True:
+            self.cv.acquire()
+            while not self.requests and not self.closed:
+                self.cv.wait()
+            if not self.requests:
+                self.cv.release()
+                return
+            due, op, args, completion = self.requests.popleft()
+            self.cv.release()
+
+            if op is None:
+                # watcher notification
+                args(*completion)
+                continue
+
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            tree.lock.acquire()
+            try:
+                result = op(self, *args)
+            finally:
+                tree.lock.release()
+            if completion is not None:
+                if not isinstance(result, tuple):
+                    result = (result,)
+                completion(self.handle, *result)
+
+    def close(self):
+        self.cv.acquire()
+        self.closed = True
+        self.cv.notify()
+        self.cv.release()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+        tree.lock.acquire()
+        try:
+            tree.expire(self)
+        finally:
+            tree.lock.release()
+
+def session(handle):
+    try:
+        return sessions[handle]
+    except KeyError:
+        raise err_to_exception(INVALIDSTATE)
+
+def init(host, watcher=None, recv_timeout=10000, client_id=None):
+    tree.lock.acquire()
+    handle = next_handle[0]
+    next_handle[0] += 1
+    tree.lock.release()
+
+    s = Session(handle, watcher)
+    sessions[handle] = s
+    if watcher is not None:
+        s.post(watcher, (handle, SESSION_EVENT, CONNECTED_STATE, ""))
+    return handle
+
+def close(handle):
+    session(handle).close()
+    del sessions[handle]
+    return OK
+
+def state(handle):
+    session(handle)
+    return CONNECTED_STATE
+
+def wait_for(handle, op, args):
+    """Submit a request and wait for its completion, the sync calls
+    are ordered with the async ones like in the C client"""
+    done = threading.Event()
+    result = []
+    def completion(h, *values):
+        result.extend(values)
+        done.set()
+    s = session(handle)
+    s.submit(op, args, completion)
+    if threading.current_thread() is s.thread:
+        raise err_to_exception(APIERROR)
+    done.wait()
+    if result[0] != OK:
+        raise err_to_exception(result[0])
+    return result[1:]
+
+def create(handle, path, value, acl, flags=0):
+    return wait_for(handle, tree.create, (path, value, flags))[0]
+
+def delete(handle, path, version=-1):
+    wait_for(handle, tree.delete, (path, version))
+    return OK
+
+def get(handle, path, watcher=None, bufferlen=1024*1024):
+    value, stat = wait_for(handle, tree.get, (path, watcher))
+    return value, stat
+
+def exists(handle, path, watcher=None):
+    try:
+        return wait_for(handle, tree.exists, (path, watcher))[0]
+    except NoNodeException:
+        return None
+
+def set(handle, path, value, version=-1):
+    wait_for(handle, tree.set, (path, value, version))
+    return OK
+
+def set2(handle, path, value, version=-1):
+    return wait_for(handle, tree.set, (path, value, version))[0]
+
+def get_children(handle, path, watcher=None):
+    return wait_for(handle, tree.get_children, (path, watcher))[0]
+
+def async(handle, path="/"):
+    done = threading.Event()
+    session(handle).submit(lambda s: OK, (), lambda h, rc: done.set())
+    done.wait()
+    return OK
+
+def acreate(handle, path, value, acl, flags=0, completion=None):
+    session(handle).submit(tree.create, (path, value, flags), completion)
+    return OK
+
+def adelete(handle, path, version=-1, completion=None):
+    session(handle).submit(tree.delete, (path, version), completion)
+    return OK
+
+def aget(handle, path, watcher=None, completion=None):
+    session(handle).submit(tree.get, (path, watcher), completion)
+    return OK
+
+def aexists(handle, path, watcher=None, completion=None):
+    session(handle).submit(tree.exists, (path, watcher), completion)
+    return OK
+
+def aset(handle, path, value, version=-1, completion=None):
+    session(handle).submit(tree.set, (path, value, version), completion)
+    return OK
+
+def aget_children(handle, path, watcher=None, completion=None):
+    session(handle).submit(tree.get_children, (path, watcher), completion)
+    return OK
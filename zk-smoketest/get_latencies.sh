@@ -22,7 +22,7 @@ done
 rm -rf test
 
 echo "Ploting async..."
-./parse_kvm_event.py -o plot_async${SUFFIX}.pdf -m 1 -M $NRUNS --latency_unit='msec' latency_async${SUFFIX}
+./parse_kvm_event.py -o plot_async${SUFFIX}.pdf -m 1 -M $NRUNS -j 0 --latency_unit='msec' latency_async${SUFFIX}
 
 
 for i in $(seq 1 $NRUNS); do
@@ -34,4 +34,4 @@ done
 rm -rf test
 
 echo "Ploting sync..."
-./parse_kvm_event.py -o plot_sync${SUFFIX}.pdf -m 1 -M $NRUNS --latency_unit='msec' latency_sync${SUFFIX}
+./parse_kvm_event.py -o plot_sync${SUFFIX}.pdf -m 1 -M $NRUNS -j 0 --latency_unit='msec' latency_sync${SUFFIX}
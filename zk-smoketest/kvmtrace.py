@@ -0,0 +1,602 @@
+#!/usr/bin/env python
+
+# Shared parsing code for kvm event traces captured by zk-latencies.py
+#
+# Input
+#       Data get from /sys/kernel/debug/tracing/trace_pipe, with the
+#       output of "virsh domifstat" before and after the trace
+#
+
+import os, re, json, struct, hashlib, tempfile
+import numpy as np
+
+USEC_PER_SEC  = 1000000
+USEC_PER_MSEC = 1000
+
+# bump when a change to the parsing changes its results, cached
+# results of older versions are then ignored
+PARSER_VERSION = 3
+
+# ftrace timestamp, e.g. "qemu-kvm-2310  [001] ....  5129.307541: kvm_exit: ..."
+TIME_PATTERN = re.compile(r'\s(\d+)\.(\d+):\s')
+
+# pid of the traced task, e.g. "qemu-kvm-2310  [001]" or "qemu-kvm-2310  ( 2300) [001]"
+PID_PATTERN = re.compile(r'-(\d+)\s+(?:\([^)]*\)\s+)?\[\d+\]')
+
+# clock calibration marker written by zk-latencies.py, see clock.py, e.g.
+# "... 5129.307541: tracing_mark_write: zk_clock begin created 5129302188004"
+CLOCK_MARKER = 'zk_clock'
+CLOCK_PATTERN = re.compile(r'zk_clock (\w+) (\S+) (\d+)')
+
+# virsh domifstat counters, e.g. "vnet0 rx_bytes 123456"
+IFSTAT_PATTERN = re.compile(r'^vnet0 (rx_bytes|tx_bytes|rx_packets|tx_packets) (\d+)')
+
+class TraceFormatError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class MissingDataError(TraceFormatError):
+    """A phase trace without the events or counters a metric needs"""
+    pass
+
+class IfStat(object):
+    """vnet0 counters, the first value seen is the start of the
+    phase and the last one the end of the phase"""
+    def __init__(self):
+        self.start = {}
+        self.end = {}
+
+    def update(self, name, value):
+        if name not in self.start:
+            self.start[name] = value
+        else:
+            self.end[name] = value
+
+    # get counter delta divided by duration (usec), per seconds
+    def get_throughput(self, name, duration):
+        if name not in self.start or name not in self.end:
+            return None
+        return (self.end[name] - self.start[name])*USEC_PER_SEC/float(duration)
+
+class ClockSync(object):
+    """Lines the monotonic clock of zk-latencies.py up with the trace
+    clock, from the calibration markers of a phase
+
+    marks are (label, phase, trace usec, monotonic ns) tuples. The
+    offset between the clocks is taken at the first and last marker
+    and interpolated in between, so a drift over the phase is
+    accounted for.
+    """
+    def __init__(self, marks):
+        if not marks:
+            raise TraceFormatError("no clock markers")
+        self.marks = sorted(marks, key=lambda m: m[3])
+        first, last = self.marks[0], self.marks[-1]
+        self.start_ns = first[3]
+        self.start_offset = first[2] * 1000 - first[3]
+        self.end_offset = last[2] * 1000 - last[3]
+        # offset change per ns of monotonic time
+        self.slope = 0.0
+        if last[3] != first[3]:
+            self.slope = float(self.end_offset - self.start_offset) / (last[3] - first[3])
+
+    # ns to add to a monotonic time to get the trace time
+    def offset(self, ns):
+        return self.start_offset + self.slope * (ns - self.start_ns)
+
+    # change of the offset from the first to the last marker, in ns
+    def drift(self):
+        return self.end_offset - self.start_offset
+
+    # trace timestamp (usec) of a monotonic time in ns, or of a numpy array of them
+    def to_trace_usec(self, ns):
+        if isinstance(ns, np.ndarray):
+            ns = ns.astype(np.float64)
+            return ((ns + self.offset(ns)) / 1000.0).astype(np.int64)
+        return long((ns + self.offset(ns)) // 1000)
+
+    # monotonic time in ns of a trace timestamp (usec)
+    def from_trace_usec(self, usec):
+        return long((usec * 1000 - self.start_offset + self.slope * self.start_ns) /
+                    (1.0 + self.slope))
+
+class ArrivalStats(object):
+    """Inter-arrival distribution and peak rates of sorted event
+    timestamps (usec)
+
+    - gap_percentiles: percentile -> inter-arrival time in usec
+    - cv: standard deviation over mean of the inter-arrival times, 1
+      for Poisson arrivals, above 1 when they come in bursts
+    - burstiness: (std - mean) / (std + mean) of the inter-arrival
+      times, -1 for periodic arrivals, 0 for Poisson ones and towards 1
+      for bursts
+    - peak_rates: window msec -> most events in any window of that
+      length, in events/sec. A window holding the most events can be
+      slid to start at one of them, so only those windows are counted.
+    """
+    def __init__(self, events, windows=(1, 10, 100),
+                 percentiles=(50, 90, 99, 99.9)):
+        self.count = len(events)
+        gaps = np.diff(events)
+        self.gap_percentiles = dict((p, 0.0) for p in percentiles)
+        self.mean_usec = self.cv = self.burstiness = 0.0
+        if len(gaps):
+            self.gap_percentiles = dict(zip(percentiles,
+                                            np.percentile(gaps, percentiles)))
+            self.mean_usec = gaps.mean()
+            std = gaps.std()
+            if self.mean_usec > 0:
+                self.cv = std / self.mean_usec
+            if std + self.mean_usec > 0:
+                self.burstiness = (std - self.mean_usec) / (std + self.mean_usec)
+        self.peak_rates = {}
+        for window in windows:
+            width = int(round(window*USEC_PER_MSEC))
+            if width < 1:
+                raise ValueError("window below 1 usec: %s" % (window,))
+            peak = 0
+            if self.count:
+                ends = np.searchsorted(events, events + width, 'left')
+                peak = int((ends - np.arange(self.count)).max())
+            self.peak_rates[window] = peak * float(USEC_PER_SEC) / width
+
+    def summary(self):
+        gaps = ' '.join('p%g %.1f' % (p, self.gap_percentiles[p])
+                        for p in sorted(self.gap_percentiles))
+        return 'inter-arrival usec %s mean %.1f cv %.2f burstiness %.2f' % (
+            gaps, self.mean_usec, self.cv, self.burstiness)
+
+    def peak_summary(self):
+        return 'peak rate/sec ' + ' '.join(
+            '%gms=%.1f' % (w, self.peak_rates[w]) for w in sorted(self.peak_rates))
+
+class Int64Buffer(object):
+    """Growable int64 array
+
+    Values are appended to a short python list which is packed into
+    a numpy chunk every chunk_size values, so a long trace costs
+    8 bytes per value instead of a python long per value.
+    """
+    def __init__(self, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.pending = []
+
+    def append(self, value):
+        self.pending.append(value)
+        if len(self.pending) >= self.chunk_size:
+            self.chunks.append(np.array(self.pending, dtype=np.int64))
+            self.pending = []
+
+    def __len__(self):
+        return sum(len(c) for c in self.chunks) + len(self.pending)
+
+    def finalize(self):
+        chunks = self.chunks
+        if self.pending:
+            chunks = chunks + [np.array(self.pending, dtype=np.int64)]
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(chunks)
+
+class EventSeries(object):
+    """Timestamps (usec) of one type of event"""
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.first_event = None
+        self.ifstat = IfStat()
+        self.buffer = Int64Buffer()
+        self.pid_buffer = None
+        self._events = None
+        self._pids = None
+
+    def add(self, usec, pid=None):
+        self.buffer.append(usec)
+        if self.pid_buffer is not None:
+            self.pid_buffer.append(pid)
+
+    def finalize(self):
+        events = self.buffer.finalize()
+        pids = None
+        if self.pid_buffer is not None:
+            pids = self.pid_buffer.finalize()
+        if len(events) > 1 and np.any(events[1:] < events[:-1]):
+            order = np.argsort(events, kind='mergesort')
+            events = events[order]
+            if pids is not None:
+                pids = pids[order]
+        self._events = events
+        self._pids = pids
+        self.buffer = Int64Buffer()
+        self.pid_buffer = None
+
+    # sorted numpy array of the event timestamps
+    @property
+    def events(self):
+        if self._events is None:
+            self.finalize()
+        return self._events
+
+    # pid of the task of each event, only when parsed with_pid
+    @property
+    def pids(self):
+        if self._events is None:
+            self.finalize()
+        return self._pids
+
+    # duration in usec
+    def get_duration(self):
+        events = self.events
+        if len(events) == 0:
+            raise MissingDataError("Error: No event!")
+
+        return long(events[-1] - events[0])
+
+    # get event arrival rate in seconds
+    def get_rate(self):
+        count = len(self.events)
+        if count == 0:
+            raise MissingDataError("Error: No event!")
+
+        return float(count)*USEC_PER_SEC/float(self.get_duration())
+
+    get_throughput = get_rate
+
+    # ArrivalStats of the events, windows in msec
+    def get_arrival_stats(self, windows=(1, 10, 100)):
+        return ArrivalStats(self.events, windows)
+
+    # get rx throughput in bytes/seconds
+    def get_rx_throughput_bytes(self):
+        throughput = self.ifstat.get_throughput('rx_bytes', self.get_duration())
+        if throughput is None:
+            raise MissingDataError("No rx throughput data.")
+
+        return throughput
+
+    # get tx throughput in bytes/seconds
+    def get_tx_throughput_bytes(self):
+        throughput = self.ifstat.get_throughput('tx_bytes', self.get_duration())
+        if throughput is None:
+            raise MissingDataError("No tx throughput data.")
+
+        return throughput
+
+    # get rx throughput in packets/seconds
+    def get_rx_throughput_packets(self):
+        throughput = self.ifstat.get_throughput('rx_packets', self.get_duration())
+        if throughput is None:
+            raise MissingDataError("No rx throughput data.")
+
+        return throughput
+
+    # get tx throughput in packets/seconds
+    def get_tx_throughput_packets(self):
+        throughput = self.ifstat.get_throughput('tx_packets', self.get_duration())
+        if throughput is None:
+            raise MissingDataError("No tx throughput data.")
+
+        return throughput
+
+    # resolution in msec, number of events in each window since the
+    # first event of the trace, the last window may be partial. Without
+    # fill_gaps the empty windows after the first event are left out.
+    # with_windows gives (window indices, counts) pairs instead, the
+    # index of a window times the resolution being its time, which
+    # places the windows that are kept when gaps are left out.
+    def get_time_series(self, resolution=10, fill_gaps=True, with_windows=False):
+        return self.get_time_series_multi([resolution], fill_gaps, with_windows)[0]
+
+    # same as get_time_series for several resolutions, the events are
+    # only binned once at the finest resolution when the others are
+    # multiples of it
+    def get_time_series_multi(self, resolutions, fill_gaps=True, with_windows=False):
+        events = self.events
+        widths = [int(round(r*USEC_PER_MSEC)) for r in resolutions]
+        if min(widths) < 1:
+            raise ValueError("resolution below 1 usec: %s" % (resolutions,))
+        if len(events) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            if with_windows:
+                return [(empty, empty) for w in widths]
+            return [empty for w in widths]
+
+        # an event may come before the first timestamped line of the
+        # trace when the lines are out of order
+        first_event = self.first_event
+        if first_event is None or events[0] < first_event:
+            first_event = events[0]
+        offsets = events - first_event
+
+        finest = min(widths)
+        fine = np.bincount(offsets // finest)
+        series = []
+        for width in widths:
+            if width % finest == 0:
+                factor = width // finest
+                n_windows = -(-len(fine) // factor)
+                padded = np.zeros(n_windows*factor, dtype=np.int64)
+                padded[:len(fine)] = fine
+                ts = padded.reshape(n_windows, factor).sum(axis=1)
+            else:
+                ts = np.bincount(offsets // width)
+            windows = np.arange(len(ts))
+            if not fill_gaps:
+                start = int(offsets[0] // width)
+                windows = np.concatenate((windows[:start],
+                                          start + np.flatnonzero(ts[start:])))
+                ts = ts[windows]
+            if with_windows:
+                series.append((windows, ts))
+            else:
+                series.append(ts)
+        return series
+
+class TraceParser(object):
+    """Single pass classifier over a trace
+
+    Every line is searched once against the combined patterns of all
+    the registered series, the timestamp is only parsed for the lines
+    that match. A matching line is then given to every series whose
+    own pattern matches it.
+    """
+    def __init__(self, with_pid=False):
+        self.series = []
+        self.ifstat = IfStat()
+        self.first_event = None
+        self.event_pattern = None
+        self.with_pid = with_pid
+        self.clock_marks = []
+        self.patterns = []
+
+    def register(self, series):
+        series.ifstat = self.ifstat
+        if self.with_pid:
+            series.pid_buffer = Int64Buffer()
+        self.series.append(series)
+        self.patterns.append(re.compile(series.pattern))
+        self.event_pattern = re.compile('|'.join(
+            '(?:%s)' % (s.pattern) for s in self.series))
+        return series
+
+    def parse_time(self, line):
+        m = TIME_PATTERN.search(line)
+        if not m:
+            return None
+        return long(m.group(2)) + USEC_PER_SEC*long(m.group(1))
+
+    def parse_line(self, line):
+        if self.first_event is None:
+            self.first_event = self.parse_time(line)
+
+        m = self.event_pattern.search(line)
+        if m:
+            usec = self.parse_time(line)
+            if usec is None:
+                raise TraceFormatError("Wrong format: %s" % (line.rstrip()))
+            pid = None
+            if self.with_pid:
+                p = PID_PATTERN.search(line)
+                pid = long(p.group(1)) if p else -1
+            for series, pattern in zip(self.series, self.patterns):
+                if pattern.search(line):
+                    series.add(usec, pid)
+        elif line.startswith('vnet0'):
+            m = IFSTAT_PATTERN.match(line)
+            if m:
+                self.ifstat.update(m.group(1), long(m.group(2)))
+        elif CLOCK_MARKER in line:
+            m = CLOCK_PATTERN.search(line)
+            usec = self.parse_time(line)
+            if m and usec is not None:
+                self.clock_marks.append((m.group(1), m.group(2), usec,
+                                         long(m.group(3))))
+
+    # ClockSync of the phase, None without calibration markers
+    def clock_sync(self):
+        if not self.clock_marks:
+            return None
+        return ClockSync(self.clock_marks)
+
+    def parse(self, fp):
+        parse_line = self.parse_line
+        for line in fp:
+            parse_line(line)
+        for series in self.series:
+            series.first_event = self.first_event
+        return self
+
+# Binary columnar phase file
+#
+#       "KVMB", version, header length (uint32 each)
+#       json header: event types, count and column offsets of each
+#                    type, first_event, ifstat start/end counters
+#       int64 timestamp (usec) column
+#       int32 pid column
+#       uint8 event type column
+#
+# the events are grouped by type and sorted by time within a type, so
+# each series is a slice of the memory mapped columns.
+
+BINARY_MAGIC = 'KVMB'
+BINARY_VERSION = 1
+BINARY_SUFFIX = '.kvmb'
+
+def binary_path(in_file):
+    return os.path.splitext(in_file)[0] + BINARY_SUFFIX
+
+def save_binary(out_file, trace):
+    types = [s.pattern for s in trace.series]
+    counts = [len(s.events) for s in trace.series]
+    n = sum(counts)
+    header = json.dumps({'types': types,
+                         'counts': counts,
+                         'first_event': trace.first_event,
+                         'ifstat_start': trace.ifstat.start,
+                         'ifstat_end': trace.ifstat.end,
+                         'clock_marks': trace.clock_marks})
+    # keep the int64 column aligned
+    header += ' ' * (-(12 + len(header)) % 8)
+
+    with open(out_file, 'wb') as fp:
+        fp.write(BINARY_MAGIC)
+        fp.write(struct.pack('<II', BINARY_VERSION, len(header)))
+        fp.write(header)
+        for s in trace.series:
+            fp.write(s.events.astype('<i8').tostring())
+        for s in trace.series:
+            pids = s.pids
+            if pids is None:
+                pids = np.zeros(len(s.events), dtype='<i4') - 1
+            fp.write(pids.astype('<i4').tostring())
+        for i, count in enumerate(counts):
+            fp.write(np.full(count, i, dtype=np.uint8).tostring())
+    return n
+
+def load_binary(in_file, series=None):
+    """Memory map a binary phase file into a TraceParser whose series
+    hold slices of the columns, or return None if the file doesn't
+    hold all the requested series"""
+    with open(in_file, 'rb') as fp:
+        if fp.read(4) != BINARY_MAGIC:
+            raise TraceFormatError("%s is not a binary trace" % (in_file))
+        version, header_len = struct.unpack('<II', fp.read(8))
+        if version != BINARY_VERSION:
+            raise TraceFormatError("%s has version %d" % (in_file, version))
+        header = json.loads(fp.read(header_len))
+
+    types = header['types']
+    counts = header['counts']
+    if series is None:
+        series = [EventSeries(t) for t in types]
+    if any(s.pattern not in types for s in series):
+        return None
+
+    offset = 12 + header_len
+    n = sum(counts)
+    if n:
+        ts = np.memmap(in_file, dtype='<i8', mode='r', offset=offset, shape=(n,))
+        pids = np.memmap(in_file, dtype='<i4', mode='r', offset=offset + 8*n, shape=(n,))
+    else:
+        ts = np.zeros(0, dtype=np.int64)
+        pids = np.zeros(0, dtype=np.int32)
+
+    trace = TraceParser()
+    trace.first_event = header['first_event']
+    for name, value in header['ifstat_start'].items():
+        trace.ifstat.start[str(name)] = value
+    for name, value in header['ifstat_end'].items():
+        trace.ifstat.end[str(name)] = value
+    trace.clock_marks = [(str(label), str(phase), usec, ns)
+                         for label, phase, usec, ns in header.get('clock_marks', [])]
+
+    starts = np.concatenate(([0], np.cumsum(counts)))
+    for s in series:
+        i = types.index(s.pattern)
+        trace.register(s)
+        s.first_event = trace.first_event
+        s._events = ts[starts[i]:starts[i + 1]]
+        s._pids = pids[starts[i]:starts[i + 1]]
+    return trace
+
+class ParseCache(object):
+    """Parsed phases kept as binary phase files in cache_dir
+
+    An entry is keyed by the path, size and mtime of the trace, the
+    parser version and the requested events. The least recently used
+    entries are evicted once the cache grows over max_bytes.
+    """
+    def __init__(self, cache_dir=None, max_bytes=1 << 30):
+        if cache_dir is None:
+            cache_dir = os.environ.get('HTPERF_CACHE',
+                                       os.path.expanduser('~/.cache/htperf'))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def entry_path(self, in_file, series):
+        st = os.stat(in_file)
+        key = repr((os.path.abspath(in_file), st.st_size, st.st_mtime,
+                    PARSER_VERSION, sorted(s.pattern for s in series)))
+        return os.path.join(self.cache_dir,
+                            hashlib.sha1(key).hexdigest() + BINARY_SUFFIX)
+
+    def load(self, in_file, series):
+        path = self.entry_path(in_file, series)
+        if not os.path.exists(path):
+            return None
+        try:
+            trace = load_binary(path, series)
+        except (TraceFormatError, ValueError, struct.error, EnvironmentError):
+            # truncated or partly written, parsed again like a miss
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        if trace is not None:
+            # most recently used
+            os.utime(path, None)
+        return trace
+
+    def store(self, in_file, trace):
+        path = self.entry_path(in_file, trace.series)
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+        fd, tmp_file = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        os.close(fd)
+        save_binary(tmp_file, trace)
+        os.rename(tmp_file, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(BINARY_SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+
+def load_trace(in_file, series, cache=None):
+    """Parse the phase trace into the series, from the binary phase
+    file when there is an up to date one, or else from the cache"""
+    bin_file = binary_path(in_file)
+    if (os.path.exists(bin_file) and
+        (not os.path.exists(in_file) or
+         os.path.getmtime(bin_file) >= os.path.getmtime(in_file))):
+        trace = load_binary(bin_file, series)
+        if trace is not None:
+            return trace
+
+    if cache is not None:
+        trace = cache.load(in_file, series)
+        if trace is not None:
+            return trace
+
+    trace = TraceParser()
+    for s in series:
+        trace.register(s)
+    with open(in_file) as fp:
+        trace.parse(fp)
+
+    if cache is not None:
+        cache.store(in_file, trace)
+    return trace
@@ -0,0 +1,188 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math, array
+
+PERCENTILES = [50.0, 90.0, 99.0, 99.9]
+
+class LatencyHistogram(object):
+    """Log-linear histogram of latencies in usec, like HdrHistogram
+
+    Values below 2^sub_bucket_bits usec are counted exactly, above that
+    every power of two is split into 2^(sub_bucket_bits-1) buckets, so
+    the relative error stays below 2^-(sub_bucket_bits-1) (0.8% for the
+    default of 8 bits) with a few thousand counters at most.
+
+    With keep_samples the start time and latency, in seconds, of the
+    values recorded with a start are also kept, for dump_samples().
+    """
+    def __init__(self, sub_bucket_bits=8, keep_samples=False):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.counts = [0] * self.sub_bucket_count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.samples = None
+        if keep_samples:
+            self.samples = array.array('d')
+
+    def index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return (self.sub_bucket_count + (shift - 1) * self.half_count +
+                (value >> shift) - self.half_count)
+
+    def highest_value(self, index):
+        """highest value counted in the bucket at index"""
+        if index < self.sub_bucket_count:
+            return index
+        shift, sub = divmod(index - self.sub_bucket_count, self.half_count)
+        shift += 1
+        return ((sub + self.half_count + 1) << shift) - 1
+
+    def record(self, usec):
+        value = int(usec)
+        if value < 0:
+            value = 0
+        i = self.index(value)
+        counts = self.counts
+        if i >= len(counts):
+            counts.extend([0] * (i + 1 - len(counts)))
+        counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    # latency given in seconds
+    def record_seconds(self, seconds, start=None):
+        self.record(seconds * 1000000)
+        if self.samples is not None and start is not None:
+            self.samples.extend((start, seconds))
+
+    def merge(self, other):
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("histograms of different precision")
+        counts = self.counts
+        if len(other.counts) > len(counts):
+            counts.extend([0] * (len(other.counts) - len(counts)))
+        for i, c in enumerate(other.counts):
+            if c:
+                counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        return self
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0
+        target = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return min(self.highest_value(i), self.max)
+        return self.max
+
+    def count_above(self, usec):
+        """number of values in the buckets above usec"""
+        return sum(c for i, c in enumerate(self.counts)
+                   if c and self.highest_value(i) > usec)
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return float(self.total) / self.count
+
+    def summary(self, percentiles=PERCENTILES):
+        """latencies in ms, e.g. 'p50 0.412 p90 0.801 ... max 5.210 ms'"""
+        fields = ["p%g %.3f" % (p, self.percentile(p) / 1000.0)
+                  for p in percentiles]
+        fields.append("max %.3f ms" % (self.max / 1000.0))
+        return " ".join(fields)
+
+    def to_dict(self):
+        """compact form, only the non empty buckets"""
+        return {'bits': self.sub_bucket_bits,
+                'buckets': [(i, c) for i, c in enumerate(self.counts) if c],
+                'count': self.count, 'total': self.total,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls(d['bits'])
+        for i, c in d['buckets']:
+            if i >= len(h.counts):
+                h.counts.extend([0] * (i + 1 - len(h.counts)))
+            h.counts[i] = c
+        h.count = d['count']
+        h.total = d['total']
+        h.min = d['min']
+        h.max = d['max']
+        return h
+
+class LatencyRecorder(object):
+    """Latency of every call of a client, a histogram per operation
+
+    With keep_samples the start time and latency of each call are also
+    kept, as doubles, for dump().
+    """
+    def __init__(self, keep_samples=False):
+        self.keep_samples = keep_samples
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.samples = {}
+
+    def record(self, op, start, end):
+        h = self.histograms.get(op)
+        if h is None:
+            h = self.histograms[op] = LatencyHistogram()
+            if self.keep_samples:
+                self.samples[op] = array.array('d')
+        h.record((end - start) * 1000000)
+        if self.keep_samples:
+            self.samples[op].extend((start, end - start))
+
+    def merge(self, other):
+        for op, h in other.histograms.items():
+            if op in self.histograms:
+                self.histograms[op].merge(h)
+            else:
+                self.histograms[op] = LatencyHistogram().merge(h)
+        for op, samples in other.samples.items():
+            self.samples.setdefault(op, array.array('d')).extend(samples)
+        return self
+
+    def dump(self, fp):
+        for op, samples in sorted(self.samples.items()):
+            dump_samples(fp, op, samples)
+
+def dump_samples(fp, op, samples):
+    """one 'op start(sec) latency(usec)' line per call, the start time
+    is on the clock of clock.now()"""
+    for i in xrange(0, len(samples), 2):
+        fp.write("%s %.6f %d\n" % (op, samples[i], samples[i + 1] * 1000000))
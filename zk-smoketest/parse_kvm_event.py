@@ -2,7 +2,8 @@
 
 # Metrics 
 #       - event/sec
-#       - inter-arrival rate
+#       - inter-arrival rate, distribution and peak rates over sliding
+#         windows with --windows
 #
 # Events of interest
 #       - apic write
@@ -14,10 +15,15 @@
 #
 
 import sys, re
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 
+from kvmtrace import TraceFormatError, MissingDataError, EventSeries, \
+    ParseCache, load_trace
+from correlate import RequestLog, Correlation
+
 import argparse
 
 parser = argparse.ArgumentParser()
@@ -50,131 +56,126 @@ parser.add_argument('-u', '--latency_unit', action="store",
 parser.add_argument('-l', '--log_scale', action="store_true",
                     dest='log_scale',
                     default=False)
+
+parser.add_argument('-j', '--jobs', action="store",
+                    dest='jobs',
+                    default=1, type=int,
+                    help='number of processes parsing the traces, 0 for one per core')
+parser.add_argument('--cache_dir', action="store",
+                    dest='cache_dir',
+                    default=None,
+                    help='where parsed traces are cached (default $HTPERF_CACHE or ~/.cache/htperf)')
+
+parser.add_argument('--cache_size', action="store",
+                    dest='cache_size',
+                    default=1024, type=int,
+                    help='size limit of the parse cache in MB (default %(default)s)')
+
+parser.add_argument('--no_cache', action="store_true",
+                    dest='no_cache',
+                    default=False)
+
+parser.add_argument('-b', '--batched', action="store_true",
+                    dest='batched',
+                    default=False,
+                    help='also report the batch_created, batch_set and batch_deleted phases of zk-latencies.py --batch_size, with the exits per logical request')
+
+parser.add_argument('-s', '--sizes', action="store",
+                    dest='sizes',
+                    default=None,
+                    help='comma separated znode sizes in bytes of a zk-latencies.py --znode_size sweep, reports how the request and exit rates scale with the size')
+
+parser.add_argument('-w', '--windows', action="store",
+                    dest='windows',
+                    default=None,
+                    help='comma separated window lengths in msec, reports the inter-arrival distribution of each event and its peak rate over sliding windows of these lengths')
+
+parser.add_argument('-c', '--correlate', action="store_true",
+                    dest='correlate',
+                    default=False,
+                    help='attribute the exits of each phase to its requests, from the <phase>_latencies.txt of zk-latencies.py --dump_latencies, and report the exits per request and the latency they add')
 args = parser.parse_args()
 
-USEC_PER_SEC = 1000000
-
-class EventSeries:
-    def __init__(self, pattern):
-        self.event_pattern = re.compile(pattern)
-        self.events = []
-        self.parse_time = re.compile('.+\s(\d+)\.(\d+):\s.+')
-        self.tx_bytes_start = None
-        self.tx_packets_start = None
-        self.rx_bytes_start = None
-        self.rx_packets_start = None
-        self.tx_bytes_end = None
-        self.tx_bytes_end = None
-        self.rx_packets_end = None
-        self.rx_packets_end = None
-
-    def try_add(self, line):
-        if self.event_pattern.search(line):
-            m = self.parse_time.search(line)
-            if not m:
-                print "Wrong format."
-                sys.exit()
-
-            ts_sec = m.group(1)
-            ts_usec = m.group(2)
-            try:
-                usec = long(ts_usec) + USEC_PER_SEC*long(ts_sec)
-                self.events.append(usec)
-                # print "Added: " + line
-            except ValueError:
-                print "Wrong format."
-                sys.exit()
-        else:
-            m = re.search('^vnet0 rx_bytes (\d+)', line)
-            if m:
-                if not self.rx_bytes_start:
-                    self.rx_bytes_start = long(m.group(1))
-                else:
-                    self.rx_bytes_end = long(m.group(1))
-            m = re.search('^vnet0 tx_bytes (\d+)', line)
-            if m:
-                if not self.tx_bytes_start:
-                    self.tx_bytes_start = long(m.group(1))
-                else:
-                    self.tx_bytes_end = long(m.group(1))
-            m = re.search('^vnet0 rx_packets (\d+)', line)
-            if m:
-                if not self.rx_packets_start:
-                    self.rx_packets_start = long(m.group(1))
-                else:
-                    self.rx_packets_end = long(m.group(1))
-            m = re.search('^vnet0 tx_packets (\d+)', line)
-            if m:
-                if not self.tx_packets_start:
-                    self.tx_packets_start = long(m.group(1))
-                else:
-                    self.tx_packets_end = long(m.group(1))
-
-    # duration in usec
-    def get_duration(self):
-        count = len(self.events)
-        if count == 0:
-            print "Error: No event!"
-            sys.exit()
-
-        duration = self.events[count - 1] - self.events[0]
-        return duration
-
-    # get event arrival rate in seconds
-    def get_rate(self):
-        count = len(self.events)
-        if count == 0:
-            print "Error: No event!"
-            sys.exit()
-
-        return float(count)*USEC_PER_SEC/float(self.get_duration())
-
-    # get rx throughput in bytes/seconds
-    def get_rx_throughput_bytes(self):
-        if not (self.rx_bytes_start or self.rx_bytes_end):
-            print "No rx throughput data."
-            sys.exit()
-
-        return (self.rx_bytes_end - self.rx_bytes_start)*USEC_PER_SEC/float(self.get_duration())
-
-    # get tx throughput in bytes/seconds
-    def get_tx_throughput_bytes(self):
-        if not (self.tx_bytes_start or self.tx_bytes_end):
-            print "No tx throughput data."
-            sys.exit()
-
-        return (self.tx_bytes_end - self.tx_bytes_start)*USEC_PER_SEC/float(self.get_duration())
-
-    # get rx throughput in packets/seconds
-    def get_rx_throughput_packets(self):
-        if not (self.rx_packets_start or self.rx_packets_end):
-            print "No rx throughput data."
-            sys.exit()
-
-        return (self.rx_packets_end - self.rx_packets_start)*USEC_PER_SEC/float(self.get_duration())
-
-    # get tx throughput in packets/seconds
-    def get_tx_throughput_packets(self):
-        if not (self.tx_packets_start or self.tx_packets_end):
-            print "No tx throughput data."
-            sys.exit()
-
-        return (self.tx_packets_end - self.tx_packets_start)*USEC_PER_SEC/float(self.get_duration())
+cache = None
+if not args.no_cache:
+    cache = ParseCache(args.cache_dir, args.cache_size << 20)
+
+windows = None
+if args.windows:
+    windows = [float(window) for window in args.windows.split(',')]
+
+EVENTS = ['apic_write', 'apic_read', 'pio_write']
+
+# parse the trace of one (experiment, operation), runs in a worker
+# process when --jobs is given so only the rates are sent back
+def parse_phase(in_file):
+    series = [EventSeries(event) for event in EVENTS]
+    try:
+        load_trace(in_file, series, cache)
+    except TraceFormatError:
+        print "Wrong format."
+        return None
+
+    try:
+        result = dict((s.pattern, s.get_rate()) for s in series)
+        result['rx_packets'] = series[0].get_rx_throughput_packets()
+        result['tx_packets'] = series[0].get_tx_throughput_packets()
+        if windows:
+            result['arrivals'] = dict((s.pattern, s.get_arrival_stats(windows))
+                                      for s in series)
+    except MissingDataError, e:
+        print e.value
+        return None
+    return result
+
+# lines of the correlation report of a phase, runs in a worker process
+# like parse_phase
+def correlate_phase(in_file):
+    series = [EventSeries(event) for event in EVENTS]
+    try:
+        trace = load_trace(in_file, series, cache)
+        requests = RequestLog.load(in_file[:-len('.txt')] + '_latencies.txt')
+        return Correlation(requests, trace, series).report()
+    except (TraceFormatError, IOError), e:
+        return ['\tno correlation: %s' % (e)]
+
+def parse_phases(in_files, parse=parse_phase):
+    """parse(in_file) of each file, in order"""
+    if args.jobs == 1:
+        return map(parse, in_files)
+    pool = multiprocessing.Pool(args.jobs or None)
+    phases = pool.map(parse, in_files, chunksize=1)
+    pool.close()
+    pool.join()
+    return phases
+
+# phases parse_phase returned None for, the report goes on without them
+# and the script exits with status 1
+skipped = []
 
 class ParseZKLatency:
     def __init__(self, in_file):
         self.test_info = {}
+        size = None
         with open(in_file) as fp:
             for line in fp:
+                # phases of a --znode_size sweep follow their size
+                m = re.match("znode size: (\d+) bytes", line)
+                if m:
+                    size = int(m.group(1))
+                    continue
                 m = re.search("(\S+)\s+(\d+)\s+permanent.+\s(\d+\.\d+)/sec\)", line)
                 if m:
                     self.znode_count = m.group(2)
                     self.test_info[m.group(1)] = float(m.group(3))
+                    self.test_info[(m.group(1), size)] = float(m.group(3))
                     # print 'Added: (' + m.group(1) + ',' + m.group(3) + ')'
 
 
-    def get_info(self, field):
-        return self.test_info[field]
+    def get_info(self, field, size=None):
+        if size is None:
+            return self.test_info[field]
+        return self.test_info[(field, size)]
 
 class Series2D:
     def __init__(self, ysize):
@@ -185,11 +186,13 @@ class Series2D:
         # print "Adding item %d to data[%d]." %(item, y-1)
         self.data[y].append(item)
 
+    # the phases skipped for missing data are NaN, left out of the
+    # mean and std of the experiments
     def get_means(self):
-        return np.mean(self.data, axis=0)
+        return np.nanmean(self.data, axis=0)
 
     def get_std(self):
-        return np.std(self.data, axis=0)
+        return np.nanstd(self.data, axis=0)
 
     def dump(self):
         print "DATA: "
@@ -199,6 +202,70 @@ class Series2D:
         print "STD: "
         print self.get_std()
 
+SWEEP_METRICS = ['requests'] + EVENTS
+
+def size_sweep(sizes, operations):
+    """Report and plot the request and exit rates of each operation by
+    znode size, averaged over the experiments"""
+    n_exps = args.max_exp_idx - args.min_exp_idx + 1
+    rates = dict(((metric, ops), Series2D(n_exps))
+                 for metric in SWEEP_METRICS for ops in operations)
+
+    in_files = []
+    for exp_idx in range(args.min_exp_idx, args.max_exp_idx + 1):
+        exp_name = args.input + str(exp_idx)
+        for ops in operations:
+            for size in sizes:
+                in_files.append('%s/%s_s%d.txt' % (exp_name, ops, size))
+    phases = iter(parse_phases(in_files))
+
+    for exp_idx in range(args.min_exp_idx, args.max_exp_idx + 1):
+        exp_name = args.input + str(exp_idx)
+        zk_latency = ParseZKLatency(exp_name + '/latencies.txt')
+        n_idx = exp_idx - args.min_exp_idx
+        for ops in operations:
+            for size in sizes:
+                phase = phases.next()
+                if phase is None:
+                    skipped.append('%s/%s_s%d.txt' % (exp_name, ops, size))
+                    phase = dict((event, np.nan) for event in EVENTS)
+                rates[('requests', ops)].append_to_row(
+                    n_idx, zk_latency.get_info(ops, size))
+                for event in EVENTS:
+                    rates[(event, ops)].append_to_row(n_idx, phase[event])
+
+    for ops in operations:
+        means = dict((metric, rates[(metric, ops)].get_means())
+                     for metric in SWEEP_METRICS)
+        print 'OPERATION: %s' % (ops)
+        print '%8s %14s %s %s' % ('size', 'requests/sec',
+                                  ' '.join('%14s' % (e + '/sec') for e in EVENTS),
+                                  ' '.join('%14s' % (e + '/req') for e in EVENTS))
+        for i, size in enumerate(sizes):
+            requests = means['requests'][i]
+            print '%8d %14.1f %s %s' % (
+                size, requests,
+                ' '.join('%14.1f' % (means[e][i]) for e in EVENTS),
+                ' '.join('%14.3f' % (means[e][i] / max(requests, 1e-9))
+                         for e in EVENTS))
+
+    with PdfPages(args.output_file) as pdf:
+        for metric in SWEEP_METRICS:
+            fig, ax = plt.subplots()
+            for ops in operations:
+                series = rates[(metric, ops)]
+                plt.errorbar(sizes, series.get_means(), yerr=series.get_std(),
+                             marker='o', label=ops)
+            plt.xscale('log')
+            if args.log_scale:
+                plt.yscale('log')
+            plt.xlabel('znode size (bytes)')
+            plt.ylabel(metric + '/sec')
+            plt.title('Zookeeper %s rates by znode size' % (metric))
+            plt.legend(loc=2)
+            pdf.savefig()
+            plt.close()
+
 
 if __name__ == '__main__':
     TIME_SCALE = 1.0
@@ -206,6 +273,16 @@ if __name__ == '__main__':
         TIME_SCALE = 0.0001
 
     operations = ['created', 'set', 'get', 'deleted']
+    if args.batched:
+        operations += ['batch_created', 'batch_set', 'batch_deleted']
+
+    if args.sizes:
+        size_sweep([int(size) for size in args.sizes.split(',')], operations)
+        if skipped:
+            print "%d phases skipped: %s" % (len(skipped), ' '.join(skipped))
+            sys.exit(1)
+        sys.exit()
+
     n_ops = len(operations)
     n_exps = args.max_exp_idx - args.min_exp_idx + 1
     tx_rates = Series2D(n_exps)
@@ -215,6 +292,17 @@ if __name__ == '__main__':
     apic_read_rates = Series2D(n_exps)
     pio_write_rates = Series2D(n_exps)
 
+    in_files = []
+    for exp_idx in range(args.min_exp_idx, args.max_exp_idx + 1):
+        exp_name = args.input + str(exp_idx)
+        for ops in operations:
+            in_files.append(exp_name + '/' + ops + '.txt')
+
+    phases = iter(parse_phases(in_files))
+    correlations = None
+    if args.correlate:
+        correlations = iter(parse_phases(in_files, correlate_phase))
+
     for exp_idx in range(args.min_exp_idx, args.max_exp_idx + 1):
         exp_name = args.input + str(exp_idx)
         latency_input = exp_name + '/latencies.txt'
@@ -227,28 +315,39 @@ if __name__ == '__main__':
             req_rates.append_to_row(
                 n_idx, zk_latency.get_info(ops) * TIME_SCALE)
 
-            in_file = exp_name + '/' + ops + '.txt'
-            with open(in_file) as fp:
-                apic_write = EventSeries('apic_write')
-                apic_read = EventSeries('apic_read')
-                pio_write = EventSeries('pio_write')
-                for line in fp:
-                    apic_write.try_add(line)
-                    apic_read.try_add(line)
-                    pio_write.try_add(line)
-
-            rx_rates.append_to_row(
-                n_idx, apic_write.get_rx_throughput_packets() * TIME_SCALE)
-            tx_rates.append_to_row(
-                n_idx, apic_write.get_tx_throughput_packets() * TIME_SCALE)
-
-            apic_write_rates.append_to_row(n_idx, apic_write.get_rate())
-            apic_read_rates.append_to_row(n_idx, apic_read.get_rate())
-            pio_write_rates.append_to_row(n_idx, pio_write.get_rate())
-
-            print "\tapic_write rate=%f/sec" % (apic_write.get_rate())
-            print "\tapic_read rate=%f/sec" % (apic_read.get_rate())
-            print "\tpio_write rate=%f/sec" % (pio_write.get_rate())
+            phase = phases.next()
+            if phase is None:
+                print "\tskipped, no data"
+                skipped.append(exp_name + '/' + ops + '.txt')
+                for series in (rx_rates, tx_rates, apic_write_rates,
+                              apic_read_rates, pio_write_rates):
+                    series.append_to_row(n_idx, np.nan)
+                if correlations:
+                    correlations.next()
+                continue
+
+            rx_rates.append_to_row(n_idx, phase['rx_packets'] * TIME_SCALE)
+            tx_rates.append_to_row(n_idx, phase['tx_packets'] * TIME_SCALE)
+
+            apic_write_rates.append_to_row(n_idx, phase['apic_write'])
+            apic_read_rates.append_to_row(n_idx, phase['apic_read'])
+            pio_write_rates.append_to_row(n_idx, phase['pio_write'])
+
+            print "\tapic_write rate=%f/sec" % (phase['apic_write'])
+            print "\tapic_read rate=%f/sec" % (phase['apic_read'])
+            print "\tpio_write rate=%f/sec" % (phase['pio_write'])
+            if args.batched:
+                for event in EVENTS:
+                    print "\t%s per request=%f" % (
+                        event, phase[event] / max(zk_latency.get_info(ops), 1e-9))
+            if windows:
+                for event in EVENTS:
+                    arrivals = phase['arrivals'][event]
+                    print "\t%s %s" % (event, arrivals.summary())
+                    print "\t%s %s" % (event, arrivals.peak_summary())
+            if correlations:
+                for line in correlations.next():
+                    print line
 
     # Graphing
     fig, ax = plt.subplots()
@@ -323,3 +422,7 @@ if __name__ == '__main__':
         # plt.tight_layout()
         pdf.savefig()
         plt.close()
+
+    if skipped:
+        print "%d phases skipped: %s" % (len(skipped), ' '.join(skipped))
+        sys.exit(1)
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+# Checks of the kvm trace parsing, run with
+#       python -m unittest test_kvmtrace
+#
+
+import unittest
+
+from kvmtrace import TraceParser, EventSeries
+
+class TimeSeriesTest(unittest.TestCase):
+    def test_out_of_order_first_event(self):
+        # the first timestamped line is later than the second event
+        trace = TraceParser()
+        series = trace.register(EventSeries('apic_write'))
+        trace.parse(['  qemu-kvm-2310  [000] ....  100.000500: kvm_apic: apic_write APIC_EOI = 0x0\n',
+                     '  qemu-kvm-2310  [001] ....  100.000100: kvm_apic: apic_write APIC_EOI = 0x0\n'])
+        self.assertEqual(series.events.tolist(), [100000100, 100000500])
+        self.assertEqual(series.get_time_series(0.1).tolist(), [1, 0, 0, 0, 1])
+        self.assertEqual(series.get_time_series(0.1, fill_gaps=False).tolist(), [1, 1])
+        windows, counts = series.get_time_series(0.1, False, with_windows=True)
+        self.assertEqual(windows.tolist(), [0, 4])
+
+if __name__ == '__main__':
+    unittest.main()
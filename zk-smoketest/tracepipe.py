@@ -0,0 +1,188 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os, re, errno, fcntl, select, subprocess, threading, time
+
+TRACE_PIPE = "/sys/kernel/debug/tracing/trace_pipe"
+
+READ_SIZE = 1 << 20
+
+class TracePipeError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+class TracePipeReader(object):
+    """Streams trace_pipe from a dedicated thread
+
+    The pipe is read in large non-blocking chunks for the whole run.
+    Between begin() and end() the lines containing `pattern`, or one
+    of a tuple of patterns, are appended to the phase file, the rest of
+    the time they are dropped, so there is no need to flush the pipe
+    before each phase.
+
+    `path` may be any FIFO or regular file standing in for trace_pipe.
+    When it can't be opened directly (trace_pipe is root only) it is
+    read through "sudo cat". When it doesn't exist (no debugfs) and
+    isn't required, nothing is captured and enabled() is False.
+    """
+    def __init__(self, path=TRACE_PIPE, pattern="kvm_", poll=0.1,
+                 required=True):
+        self.path = path
+        self.required = required
+        if isinstance(pattern, basestring):
+            pattern = (pattern,)
+        self.patterns = pattern
+        self.search = re.compile("|".join(re.escape(p) for p in pattern)).search
+        self.poll = poll
+        self.fd = None
+        self.process = None
+        self.thread = None
+        self.running = False
+        self.lock = threading.Condition()
+        self.out = None
+        self.request = None
+        self.lines = 0
+
+    def start(self):
+        try:
+            self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError, e:
+            if e.errno in (errno.ENOENT, errno.ENODEV) and not self.required:
+                return
+            if e.errno != errno.EACCES:
+                raise TracePipeError("Unable to open %s: %s" % (self.path, e))
+            self.process = subprocess.Popen(["sudo", "cat", self.path],
+                                            stdout=subprocess.PIPE)
+            self.fd = self.process.stdout.fileno()
+            flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+            fcntl.fcntl(self.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="trace_pipe")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def enabled(self):
+        return self.fd is not None
+
+    def stop(self):
+        if self.fd is None:
+            return
+        if self.out:
+            self.end()
+        self.running = False
+        self.thread.join()
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+        else:
+            os.close(self.fd)
+        self.fd = None
+
+    def begin(self, out_file):
+        """Drop what is pending in the pipe, then append the matching
+        lines to out_file until end()"""
+        if self.fd is not None:
+            self.send(("begin", out_file))
+
+    def end(self):
+        """Append what is pending in the pipe to the phase file and
+        close it, return the number of lines written"""
+        if self.fd is None:
+            return 0
+        return self.send(("end", None))
+
+    def send(self, request):
+        self.lock.acquire()
+        try:
+            self.request = request
+            while self.request is not None:
+                if not self.thread.is_alive():
+                    raise TracePipeError("reader of %s died" % (self.path))
+                self.lock.wait(self.poll)
+            return self.lines
+        finally:
+            self.lock.release()
+
+    def drain(self, tail):
+        """Read until the pipe is empty, return the unfinished line"""
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    return tail
+                raise
+            if not data:
+                return tail
+            tail = self.write(tail + data)
+
+    def write(self, data):
+        lines = data.split('\n')
+        tail = lines.pop()
+        if self.out:
+            if len(self.patterns) == 1:
+                pattern = self.patterns[0]
+                matched = [l for l in lines if pattern in l]
+            else:
+                search = self.search
+                matched = [l for l in lines if search(l)]
+            if matched:
+                self.out.write('\n'.join(matched))
+                self.out.write('\n')
+                self.lines += len(matched)
+        return tail
+
+    def handle(self, request, tail):
+        command, out_file = request
+        tail = self.drain(tail)
+        if command == "begin":
+            # a partial line belongs to the previous phase
+            tail = ''
+            self.out = open(out_file, 'a', READ_SIZE)
+            self.lines = 0
+        elif self.out:
+            self.out.close()
+            self.out = None
+        return tail
+
+    def run(self):
+        tail = ''
+        while self.running:
+            if self.request is not None:
+                self.lock.acquire()
+                tail = self.handle(self.request, tail)
+                self.request = None
+                self.lock.notifyAll()
+                self.lock.release()
+
+            readable = select.select([self.fd], [], [], self.poll)[0]
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    continue
+                raise
+            if not data:
+                # EOF on a regular file or a FIFO without writer
+                time.sleep(self.poll)
+                continue
+            tail = self.write(tail + data)
@@ -0,0 +1,152 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re, bisect, random, array
+
+# operations of a mixed workload, all of them on existing znodes
+OPS = ["get", "set", "exists", "get_children"]
+
+DISTRIBUTIONS = ["uniform", "zipfian"]
+
+UNITS = {"": 1, "b": 1, "byte": 1, "bytes": 1,
+         "k": 1 << 10, "kb": 1 << 10, "m": 1 << 20, "mb": 1 << 20}
+
+COUNT_UNITS = {"": 1, "k": 1000, "m": 1000000}
+
+MIX_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*%\s*(\w+)$")
+KEYS_PATTERN = re.compile(r"^(uniform|zipfian|zipf)(?:\s+(\d*\.?\d+))?\s+keys"
+                          r"(?:\s+over\s+(\d+)\s*([km]?)\s+znodes)?$")
+VALUES_PATTERN = re.compile(r"^(\d+)\s*([a-z]*)\s+values?$")
+
+class WorkloadError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+def parse_size(text):
+    """bytes in '2500', '1 KB', '64k'..."""
+    m = re.match(r"^(\d+)\s*([a-z]*)$", text.strip().lower())
+    if not m or m.group(2) not in UNITS:
+        raise WorkloadError("invalid size %s" % (text))
+    return int(m.group(1)) * UNITS[m.group(2)]
+
+class Zipfian(object):
+    """Ranks 0..n-1 drawn with probability proportional to 1/(r+1)^theta,
+    rank 0 being the hottest key"""
+    def __init__(self, n, theta=0.99, rand=random):
+        self.n = n
+        self.theta = theta
+        self.random = rand
+        self.cdf = array.array('d')
+        total = 0.0
+        for r in xrange(n):
+            total += 1.0 / (r + 1) ** theta
+            self.cdf.append(total)
+        self.total = total
+
+    def next(self):
+        return min(bisect.bisect_left(self.cdf, self.random.random() * self.total),
+                   self.n - 1)
+
+class Workload(object):
+    """A mix of operations over a set of znodes, e.g. parsed from
+
+        70% get, 20% set, 10% exists, zipfian keys over 100k znodes, 1 KB values
+
+    mix is a list of (op, percent), the keys are drawn uniformly or from
+    a zipfian distribution of parameter theta.
+    """
+    def __init__(self, mix, znode_count=10000, value_size=1024,
+                 distribution="uniform", theta=0.99, seed=None):
+        total = sum(p for op, p in mix)
+        if not mix or abs(total - 100.0) > 0.01:
+            raise WorkloadError("operation percentages add up to %g, not 100" % (total))
+        for op, p in mix:
+            if op not in OPS:
+                raise WorkloadError("unknown operation %s, not one of %s" %
+                                    (op, ", ".join(OPS)))
+        if distribution not in DISTRIBUTIONS:
+            raise WorkloadError("unknown key distribution %s" % (distribution))
+        if znode_count <= 0:
+            raise WorkloadError("no znodes to operate on")
+
+        self.mix = mix
+        self.ops = [op for op, p in mix]
+        self.znode_count = znode_count
+        self.value_size = value_size
+        self.distribution = distribution
+        self.theta = theta
+        self.random = random.Random(seed)
+
+    @classmethod
+    def parse(cls, spec, znode_count=10000, value_size=1024, seed=None):
+        """znode_count and value_size are used when spec doesn't say"""
+        mix = []
+        distribution = "uniform"
+        theta = 0.99
+        for clause in spec.lower().split(","):
+            clause = " ".join(clause.split())
+            if not clause:
+                continue
+            m = MIX_PATTERN.match(clause)
+            if m:
+                mix.append((m.group(2), float(m.group(1))))
+                continue
+            m = KEYS_PATTERN.match(clause)
+            if m:
+                distribution = m.group(1) == "uniform" and "uniform" or "zipfian"
+                if m.group(2):
+                    theta = float(m.group(2))
+                if m.group(3):
+                    znode_count = int(m.group(3)) * COUNT_UNITS[m.group(4)]
+                continue
+            m = VALUES_PATTERN.match(clause)
+            if m and m.group(2) in UNITS:
+                value_size = int(m.group(1)) * UNITS[m.group(2)]
+                continue
+            raise WorkloadError("can't parse '%s' in workload %s" % (clause, spec))
+        return cls(mix, znode_count, value_size, distribution, theta, seed)
+
+    def describe(self):
+        keys = self.distribution
+        if keys == "zipfian":
+            keys = "zipfian %g" % (self.theta)
+        return "%s, %s keys over %d znodes, %d byte values" % (
+            ", ".join("%g%% %s" % (p, op) for op, p in self.mix),
+            keys, self.znode_count, self.value_size)
+
+    def generate(self, count):
+        """the op (index in self.ops) and key of count requests"""
+        rand = self.random
+        bounds = []
+        total = 0.0
+        for op, p in self.mix:
+            total += p
+            bounds.append(total)
+        if self.distribution == "zipfian":
+            key = Zipfian(self.znode_count, self.theta, rand).next
+        else:
+            n = self.znode_count
+            key = lambda: int(rand.random() * n)
+
+        ops = array.array('B')
+        keys = array.array('l')
+        last = len(bounds) - 1
+        for j in xrange(count):
+            ops.append(min(bisect.bisect_right(bounds, rand.random() * total), last))
+            keys.append(key())
+        return ops, keys
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the completion tracking of asynchronous requests
+
+Sends count asynchronous exists of the root znode and waits for them,
+either with a Condition per request, like zkclient.Callback used to,
+or with callbacks completed into one CompletionGroup. Prints the time
+per request, the latency the callbacks measure and the memory each
+callback holds until it completes.
+"""
+
+import os, sys, threading, types
+from optparse import OptionParser
+
+import clock, zkclient
+from zkclient import ZKClient, CompletionGroup, ExistsCallback
+from latency import LatencyHistogram
+
+usage = "usage: %prog [options]"
+parser = OptionParser(usage=usage)
+parser.add_option("", "--servers", dest="servers",
+                  default="localhost:2181", help="comma separated list of host:port (default %default)")
+parser.add_option("", "--timeout", dest="timeout", type="int",
+                  default=5000, help="session timeout in milliseconds (default %default)")
+parser.add_option("", "--count", dest="count", type="int",
+                  default=10000, help="requests per run (default %default)")
+parser.add_option("", "--runs", dest="runs", type="int",
+                  default=5, help="runs of each mode, the fastest is reported (default %default)")
+parser.add_option("", "--backend", dest="backend", type="choice",
+                  choices=sorted(zkclient.BACKENDS), default="fake",
+                  help="ZooKeeper binding: native, the in-process fake or the pure-python wire client (default %default)")
+parser.add_option("", "--fake_latency", dest="fake_latency", type="float",
+                  default=None, help="latency in ms the fake backend adds to each request (default $FAKEZK_LATENCY_MS or 0)")
+parser.add_option("-v", "--verbose",
+                  action="store_true", dest="verbose", default=False,
+                  help="verbose output, include more detail")
+parser.add_option("-q", "--quiet",
+                  action="store_true", dest="quiet", default=False,
+                  help="quiet output, basically just the results")
+
+(options, args) = parser.parse_args()
+
+zkclient.options = options
+zookeeper = zkclient.use_backend(options.backend, options.fake_latency)
+
+zookeeper.set_log_stream(open("cli_log_%d.txt" % (os.getpid()),"w"))
+
+class ConditionCallback(object):
+    """The former zkclient.Callback: a condition per request, acquired
+    before the request is submitted and released by waitForSuccess"""
+    def __init__(self):
+        self.cv = threading.Condition()
+        self.callback_flag = False
+        self.rc = -1
+        self.submitted = clock.now()
+        self.completed = None
+
+    def __call__(self, handle, rc, stat):
+        self.completed = clock.now()
+        self.cv.acquire()
+        self.callback_flag = True
+        self.handle = handle
+        self.rc = rc
+        self.stat = stat
+        self.cv.notify()
+        self.cv.release()
+
+    def waitForSuccess(self):
+        while not self.callback_flag:
+            self.cv.wait()
+        self.cv.release()
+        if not self.rc == zookeeper.OK:
+            raise zkclient.ZKClientError(
+                "asynchronous operation failed on handle %d with rc %d" %
+                (self.handle, self.rc))
+
+def condition_run(s, count):
+    callbacks = []
+    for j in xrange(count):
+        cb = ConditionCallback()
+        cb.cv.acquire()
+        s.aexists("/", cb)
+        callbacks.append(cb)
+    for cb in callbacks:
+        cb.waitForSuccess()
+    return callbacks
+
+def group_run(s, count):
+    group = CompletionGroup()
+    callbacks = []
+    for j in xrange(count):
+        cb = ExistsCallback(group)
+        s.aexists("/", cb)
+        callbacks.append(cb)
+    group.waitForSuccess()
+    return callbacks
+
+MODES = [("condition", lambda group: ConditionCallback(), condition_run),
+         ("group", ExistsCallback, group_run)]
+
+SHARED = (types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+          type, types.ClassType)
+
+def footprint(obj, seen):
+    """bytes of obj and of what it refers to, objects in seen (e.g.
+    shared by all the callbacks) are not counted again"""
+    if id(obj) in seen or isinstance(obj, SHARED) or obj is None:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set)):
+        size += sum(footprint(o, seen) for o in obj)
+    elif isinstance(obj, dict):
+        size += sum(footprint(k, seen) + footprint(v, seen)
+                    for k, v in obj.items())
+    if hasattr(obj, '__dict__'):
+        size += footprint(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            if hasattr(obj, name):
+                size += footprint(getattr(obj, name), seen)
+    return size
+
+def bytes_per_callback(new_callback, count=1000):
+    """memory a pending callback holds, new_callback(group) makes one"""
+    group = CompletionGroup()
+    callbacks = [new_callback(group) for j in xrange(count)]
+    # the group, and what the first callback shares with the others
+    # like its attribute names, are not counted
+    seen = set()
+    footprint(group, seen)
+    footprint(callbacks[0], seen)
+    total = sum(footprint(cb, seen) for cb in callbacks[1:])
+    return total / float(count - 1)
+
+if __name__ == '__main__':
+    s = ZKClient(options.servers, options.timeout)
+    print("%d asynchronous exists per run, best of %d runs, %s backend" %
+          (options.count, options.runs, options.backend))
+    for name, new_callback, run in MODES:
+        best = None
+        for r in xrange(options.runs):
+            start = clock.now()
+            callbacks = run(s, options.count)
+            elapsed = clock.now() - start
+            if best is None or elapsed < best[0]:
+                best = (elapsed, callbacks)
+        elapsed, callbacks = best
+        latencies = LatencyHistogram()
+        for cb in callbacks:
+            latencies.record_seconds(cb.completed - cb.submitted)
+        print("%-10s %7d requests in %6d ms (%.2f usec/op %f/sec) %6.0f bytes/callback" %
+              (name, options.count, int(elapsed * 1000),
+               elapsed * 1000000 / options.count, options.count / elapsed,
+               bytes_per_callback(new_callback)))
+        print("        latency %s" % (latencies.summary()))
+    s.close()
@@ -16,41 +16,43 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import datetime, time, os
+import os
 from optparse import OptionParser
 
-import zkclient
-from zkclient import ZKClient, CountingWatcher, zookeeper
-
-import subprocess
+import clock, zkclient
+from zkclient import ZKClient, BulkDelete, zookeeper
 
 usage = "usage: %prog [options]"
 parser = OptionParser(usage=usage)
 parser.add_option("", "--servers", dest="servers",
-                  default="localhost:2181", help="comma separated list of host:port (default %default), test each in turn")
+                  default="localhost:2181", help="comma separated list of host:port (default %default), the first one is used")
 parser.add_option("", "--cluster", dest="cluster",
-                  default=None, help="comma separated list of host:port, test as a cluster, alternative to --servers")
+                  default=None, help="comma separated list of host:port, alternative to --servers")
 parser.add_option("", "--config",
                   dest="configfile", default=None,
                   help="zookeeper configuration file to lookup cluster from")
 parser.add_option("", "--timeout", dest="timeout", type="int",
                   default=5000, help="session timeout in milliseconds (default %default)")
 parser.add_option("", "--root_znode", dest="root_znode",
-                  default="/zk-latencies", help="root for the test, will be created as part of test (default /zk-latencies)")
-parser.add_option("", "--znode_size", dest="znode_size", type="int",
-                  default=25, help="data size when creating/setting znodes (default %default)")
-parser.add_option("", "--znode_count", dest="znode_count", default=10000, type="int",
-                  help="the number of znodes to operate on in each performance section (default %default)")
-parser.add_option("", "--watch_multiple", dest="watch_multiple", default=1, type="int",
-                  help="number of watches to put on each znode (default %default)")
-
-parser.add_option("", "--force",
-                  action="store_true", dest="force", default=False,
-                  help="force the test to run, even if root_znode exists - WARNING! don't run this on a real znode or you'll lose it!!!")
-
-parser.add_option("", "--synchronous",
-                  action="store_true", dest="synchronous", default=False,
-                  help="by default asynchronous ZK api is used, this forces synchronous calls")
+                  default="/zk-latencies", help="znode to delete with everything under it (default %default)")
+parser.add_option("", "--keep_root",
+                  action="store_true", dest="keep_root", default=False,
+                  help="only delete what is under root_znode")
+parser.add_option("", "--max_outstanding", dest="max_outstanding",
+                  default=1000, type="int",
+                  help="max asynchronous deletes in flight (default %default)")
+parser.add_option("", "--page_size", dest="page_size",
+                  default=10000, type="int",
+                  help="children of a znode deleted at a time (default %default)")
+parser.add_option("", "--interval", dest="interval",
+                  default=1.0, type="float",
+                  help="seconds between progress reports (default %default)")
+
+parser.add_option("", "--backend", dest="backend", type="choice",
+                  choices=sorted(zkclient.BACKENDS), default=zkclient.DEFAULT_BACKEND,
+                  help="ZooKeeper binding: native, the in-process fake or the pure-python wire client (default %default, or $ZK_BACKEND)")
+parser.add_option("", "--fake_latency", dest="fake_latency", type="float",
+                  default=None, help="latency in ms the fake backend adds to each request (default $FAKEZK_LATENCY_MS or 0)")
 
 parser.add_option("-v", "--verbose",
                   action="store_true", dest="verbose", default=False,
@@ -59,256 +61,13 @@ parser.add_option("-q", "--quiet",
                   action="store_true", dest="quiet", default=False,
                   help="quiet output, basically just success/failure")
 
-# CUONG - begin
-parser.add_option("-l", "--log_dir", dest="log_dir",
-                  default="./", help="location to store kvm event tracing information (default is current directory)")
-# CUONG - end
-
 (options, args) = parser.parse_args()
 
 zkclient.options = options
+zookeeper = zkclient.use_backend(options.backend, options.fake_latency)
 
 zookeeper.set_log_stream(open("cli_log_%d.txt" % (os.getpid()),"w"))
 
-class SmokeError(Exception):
-    def __init__(self, value):
-        self.value = value
-    def __str__(self):
-        return repr(self.value)
-
-def print_elap(start, msg, count):
-    elapms = (time.time() - start) * 1000
-    if int(elapms) != 0:
-        print("%s in %6d ms (%f ms/op %f/sec)"
-              % (msg, int(elapms), elapms/count, count/(elapms/1000.0)))
-    else:
-        print("%s in %6d ms (included in prior)" % (msg, int(elapms)))
-
-def timer(ops, msg, count=options.znode_count, name="kvm_event"):
-    # CUONG - begin
-    logger = log_kvm_event(name)
-    # CUONG - end
-
-    start = time.time()
-    for op in ops:
-        pass
-
-    # CUONG - begin
-    stop_process(logger)
-    # CUONG - end
-
-    print_elap(start, msg, count)
-
-def timer2(func, msg, count=options.znode_count):
-    start = time.time()
-    func()
-    print_elap(start, msg, count)
-
-def child_path(i):
-    return "%s/session_%d" % (options.root_znode, i)
-
-# CUONG - begin
-def start_kvm_trace():
-    subprocess.call("sudo ~/bin/enable_trace_kvm.sh 1")
-
-def stop_kvm_trace():
-    subprocess.call("sudo ~/bin/enable_trace_kvm.sh 0")
-
-def log_kvm_event(sec_name):
-    cmd = "sudo cat /sys/kernel/debug/tracing/trace_pipe | grep kvm_ > "
-    cmd += options.log_dir + "/" + sec_name + ".txt"
-    print "start logging: " + cmd 
-
-    logger = subprocess.Popen(cmd)
-
-def stop_process(process):
-    print "stop logging."
-
-    process.terminate()
-
-# CUONG - end
-
-def synchronous_latency_test(s, data):
-    # create znode_count znodes (perm)
-    timer((s.create(child_path(j), data)
-           for j in xrange(options.znode_count)),
-          "created %7d permanent znodes " % (options.znode_count),
-          "create")
-
-    # set znode_count znodes
-    timer((s.set(child_path(j), data)
-           for j in xrange(options.znode_count)),
-          "set     %7d           znodes " % (options.znode_count),
-          "set")
-
-    # get znode_count znodes
-    timer((s.get(child_path(j))
-           for j in xrange(options.znode_count)),
-          "get     %7d           znodes " % (options.znode_count),
-          "get")
-
-    # delete znode_count znodes
-    timer((s.delete(child_path(j))
-           for j in xrange(options.znode_count)),
-          "deleted %7d permanent znodes " % (options.znode_count),
-          "delete")
-
-    # create znode_count znodes (ephemeral)
-    timer((s.create(child_path(j), data, zookeeper.EPHEMERAL)
-           for j in xrange(options.znode_count)),
-          "created %7d ephemeral znodes " % (options.znode_count),
-          "create_eph")
-
-    # watch znode_count znodes
-    watches = [CountingWatcher() for x in xrange(options.watch_multiple)]
-    def watch(j):
-        for watch in watches:
-            s.exists(child_path(j), watch)
-    timer((watch(j) for j in xrange(options.znode_count)),
-          "watched %7d           znodes " %
-          (options.watch_multiple * options.znode_count),
-          options.watch_multiple * options.znode_count,
-          "watch_eph")
-
-    # delete znode_count znodes
-    timer((s.delete(child_path(j))
-           for j in xrange(options.znode_count)),
-          "deleted %7d ephemeral znodes " % (options.znode_count),
-          "delete_eph")
-
-    start = time.time()
-    for watch in watches:
-        if watch.waitForExpected(options.znode_count, 60000) != options.znode_count:
-            raise SmokeError("wrong number of watches: %d" %
-                             (watch.count))
-
-    print_elap(start,
-               "notif   %7d           watches" % (options.watch_multiple * options.znode_count),
-               (options.watch_multiple * options.znode_count))
-
-def asynchronous_latency_test(s, data):
-    # create znode_count znodes (perm)
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.CreateCallback()
-            cb.cv.acquire()
-            s.acreate(child_path(j), cb, data)
-            callbacks.append(cb)
-
-        for j, cb in enumerate(callbacks):
-            cb.waitForSuccess()
-            if cb.path != child_path(j):
-                raise SmokeError("invalid path %s for operation %d on handle %d" %
-                                 (cb.path, j, cb.handle))
-
-    timer2(func, "created %7d permanent znodes " % (options.znode_count))
-
-    # set znode_count znodes
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.SetCallback()
-            cb.cv.acquire()
-            s.aset(child_path(j), cb, data)
-            callbacks.append(cb)
-
-        for cb in callbacks:
-            cb.waitForSuccess()
-
-    timer2(func, "set     %7d           znodes " % (options.znode_count))
-
-    # get znode_count znodes
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.GetCallback()
-            cb.cv.acquire()
-            s.aget(child_path(j), cb)
-            callbacks.append(cb)
-
-        for cb in callbacks:
-            cb.waitForSuccess()
-            if cb.value != data:
-                raise SmokeError("invalid data %s for operation %d on handle %d" %
-                                 (cb.value, j, cb.handle))
-
-    timer2(func, "get     %7d           znodes " % (options.znode_count))
-
-
-    # delete znode_count znodes (perm)
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.DeleteCallback()
-            cb.cv.acquire()
-            s.adelete(child_path(j), cb)
-            callbacks.append(cb)
-
-        for cb in callbacks:
-            cb.waitForSuccess()
-
-    timer2(func, "deleted %7d permanent znodes " % (options.znode_count))
-
-    # create znode_count znodes (ephemeral)
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.CreateCallback()
-            cb.cv.acquire()
-            s.acreate(child_path(j), cb, data, zookeeper.EPHEMERAL)
-            callbacks.append(cb)
-
-        for j, cb in enumerate(callbacks):
-            cb.waitForSuccess()
-            if cb.path != child_path(j):
-                raise SmokeError("invalid path %s for operation %d on handle %d" %
-                                 (cb.path, j, cb.handle))
-
-    timer2(func, "created %7d ephemeral znodes " % (options.znode_count))
-
-    watches = [CountingWatcher() for x in xrange(options.watch_multiple)]
-
-    # watched znode_count znodes
-    def func():
-        callbacks = []
-        for watch in watches:
-            for j in xrange(options.znode_count):
-                cb = zkclient.ExistsCallback()
-                cb.cv.acquire()
-                s.aexists(child_path(j), cb, watch)
-                callbacks.append(cb)
-
-        for cb in callbacks:
-            cb.waitForSuccess()
-
-    timer2(func, "watched %7d           znodes " %
-           (options.watch_multiple * options.znode_count),
-           options.watch_multiple * options.znode_count)
-
-    # delete znode_count znodes (ephemeral)
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.DeleteCallback()
-            cb.cv.acquire()
-            s.adelete(child_path(j), cb)
-            callbacks.append(cb)
-
-        for cb in callbacks:
-            cb.waitForSuccess()
-
-    timer2(func, "deleted %7d ephemeral znodes " % (options.znode_count))
-
-    start = time.time()
-    for watch in watches:
-        if watch.waitForExpected(options.znode_count, 60000) != options.znode_count:
-            raise SmokeError("wrong number of watches: %d" %
-                             (watch.count))
-    print_elap(start,
-               "notif   %7d           watches" % (options.watch_multiple * options.znode_count),
-               (options.watch_multiple * options.znode_count))
-
 def read_zk_config(filename):
     with open(filename) as f:
         config = dict(tuple(line.rstrip().split('=', 1)) for line in f if line.rstrip())
@@ -326,35 +85,20 @@ def get_zk_servers(filename):
         return options.servers.split(",")
 
 if __name__ == '__main__':
-    data = options.znode_size * "x"
     servers = get_zk_servers(options.configfile)
+    s = ZKClient(servers[0], options.timeout)
 
-    # create all the sessions first to ensure that all servers are
-    # at least available & quorum has been formed. otw this will 
-    # fail right away (before we start creating nodes)
-    sessions = []
-    # create one session to each of the servers in the ensemble
-    for server in servers:
-        sessions.append(ZKClient(server, options.timeout))
-
-    # ensure root_znode doesn't exist
-    if sessions[0].exists(options.root_znode):
-        # unless forced by user
-        if not options.force:
-            raise SmokeError("Node %s already exists!" % (options.root_znode))
-
-        children = sessions[0].get_children(options.root_znode)
-        for child in children:
-            sessions[0].delete("%s/%s" % (options.root_znode, child))
+    if not s.exists(options.root_znode):
+        print("Node %s doesn't exist" % (options.root_znode))
     else:
-        sessions[0].create(options.root_znode,
-                           "smoketest root, delete after test done, created %s" %
-                           (datetime.datetime.now().ctime()))
-
-    sessions[0].delete(options.root_znode)
+        bulk = BulkDelete(s, options.max_outstanding, options.page_size,
+                          not options.quiet, options.interval)
+        start = clock.now()
+        bulk.delete(options.root_znode, options.keep_root)
+        elapms = (clock.now() - start) * 1000
+        print("deleted %7d znodes under %s in %6d ms (%f/sec)"
+              % (bulk.deleted, options.root_znode, int(elapms), bulk.rate()))
 
-    # close sessions
-    for s in sessions:
-        s.close()
+    s.close()
 
-    print("Latency test complete")
+    print("Cleanup complete")
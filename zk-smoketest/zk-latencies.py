@@ -16,12 +16,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import datetime, time, os
+import datetime, os, threading, multiprocessing, hashlib
 from optparse import OptionParser
 
-import zkclient
-from zkclient import ZKClient, CountingWatcher, zookeeper
-from time import sleep
+import clock, zkclient
+from zkclient import ZKClient, TimedWatcher, NotificationLatencies, \
+    BulkDelete, wait_for_watchers, zookeeper
+from tracepipe import TracePipeReader, TRACE_PIPE
+from latency import LatencyHistogram, dump_samples
+from workload import Workload, WorkloadError, parse_size
 
 import subprocess
 
@@ -38,21 +41,52 @@ parser.add_option("", "--timeout", dest="timeout", type="int",
                   default=5000, help="session timeout in milliseconds (default %default)")
 parser.add_option("", "--root_znode", dest="root_znode",
                   default="/zk-latencies", help="root for the test, will be created as part of test (default /zk-latencies)")
-parser.add_option("", "--znode_size", dest="znode_size", type="int",
-                  default=2500, help="data size when creating/setting znodes (default %default)")
+parser.add_option("", "--znode_size", dest="znode_size",
+                  default="2500", help="data size when creating/setting znodes, e.g. 2500 or 64k; a comma separated list runs the test for each size and compares their throughput (default %default)")
 parser.add_option("", "--znode_count", dest="znode_count", default=10000, type="int",
                   help="the number of znodes to operate on in each performance section (default %default)")
-parser.add_option("", "--watch_multiple", dest="watch_multiple", default=1, type="int",
-                  help="number of watches to put on each znode (default %default)")
+parser.add_option("", "--watch_multiple", dest="watch_multiple", default="1",
+                  help="number of watches to put on each znode; a comma separated list runs the watch fan-out sweep instead of the phases (default %default)")
+parser.add_option("", "--watch_sessions", dest="watch_sessions", default="1",
+                  help="number of sessions watching each znode in the watch fan-out sweep, more than one or a comma separated list runs the sweep (default %default)")
 
 parser.add_option("", "--force",
                   action="store_true", dest="force", default=False,
                   help="force the test to run, even if root_znode exists - WARNING! don't run this on a real znode or you'll lose it!!!")
 
+parser.add_option("", "--max_outstanding", dest="max_outstanding",
+                  default="0", help="max asynchronous requests in flight, 0 for no limit; a comma separated list runs the test for each value and compares their throughput (default %default)")
+
+parser.add_option("", "--clients", "--threads", dest="clients", default=1, type="int",
+                  help="number of sessions, each driven by its own thread, sharing the znodes of each phase (default %default)")
+
+parser.add_option("", "--processes", dest="processes", default=1, type="int",
+                  help="number of load generator processes, each with --clients sessions of its own (default %default)")
+
+parser.add_option("", "--rate", dest="rate", default=None,
+                  help="open loop: send the requests of each phase at this total rate, e.g. 5000/s, instead of as fast as possible")
+parser.add_option("", "--arrivals", dest="arrivals", type="choice",
+                  choices=["poisson", "fixed"], default="poisson",
+                  help="spacing of the requests with --rate, poisson or fixed (default %default)")
+
+parser.add_option("", "--batch_size", dest="batch_size", default=0, type="int",
+                  help="also run batched create/set/delete phases sending this many operations per multi (default %default, no batched phases)")
+
+parser.add_option("", "--workload", dest="workload", default=None,
+                  help="run a mixed workload instead of the phases, e.g. \"70%% get, 20%% set, 10%% exists, zipfian keys over 100k znodes, 1 KB values\"; the number of znodes and value size default to --znode_count and --znode_size")
+parser.add_option("", "--workload_ops", dest="workload_ops", default=0, type="int",
+                  help="number of operations of the mixed workload (default one per znode)")
+
 parser.add_option("", "--synchronous",
                   action="store_true", dest="synchronous", default=False,
                   help="by default asynchronous ZK api is used, this forces synchronous calls")
 
+parser.add_option("", "--backend", dest="backend", type="choice",
+                  choices=sorted(zkclient.BACKENDS), default=zkclient.DEFAULT_BACKEND,
+                  help="ZooKeeper binding: native, the in-process fake or the pure-python wire client (default %default, or $ZK_BACKEND)")
+parser.add_option("", "--fake_latency", dest="fake_latency", type="float",
+                  default=None, help="latency in ms the fake backend adds to each request (default $FAKEZK_LATENCY_MS or 0)")
+
 parser.add_option("-v", "--verbose",
                   action="store_true", dest="verbose", default=False,
                   help="verbose output, include more detail")
@@ -63,11 +97,76 @@ parser.add_option("-q", "--quiet",
 # CUONG - begin
 parser.add_option("-l", "--log_dir", dest="log_dir",
                   default="./", help="location to store kvm event tracing information (default is current directory)")
+parser.add_option("", "--dump_latencies",
+                  action="store_true", dest="dump_latencies", default=False,
+                  help="write the start time and latency of every request of a single session to <phase>_latencies.txt in log_dir, for parse_kvm_event.py --correlate")
+parser.add_option("", "--trace_pipe", dest="trace_pipe",
+                  default=None, help="ftrace pipe to read the kvm events from, a FIFO or file can stand in for it (default %s, skipped when missing)" % (TRACE_PIPE))
+parser.add_option("", "--trace_marker", dest="trace_marker",
+                  default=clock.TRACE_MARKER, help="ftrace marker file, each phase writes the monotonic time of its beginning and end to it to line the client timings up with the kvm events (default %default)")
 # CUONG - end
 
 (options, args) = parser.parse_args()
 
+if options.rate:
+    rate = options.rate
+    if rate.endswith("/s"):
+        rate = rate[:-2]
+    try:
+        options.rate = float(rate)
+    except ValueError:
+        parser.error("invalid --rate %s" % (options.rate))
+    if options.rate <= 0:
+        parser.error("--rate must be positive")
+    if options.synchronous:
+        parser.error("--rate needs asynchronous calls")
+
+try:
+    sizes = [parse_size(size) for size in options.znode_size.split(",")]
+except WorkloadError, e:
+    parser.error(e.value)
+options.znode_size = sizes[0]
+if len(sizes) > 1 and "," in options.max_outstanding:
+    parser.error("sweep either --znode_size or --max_outstanding, not both")
+
+try:
+    watch_multiples = [int(m) for m in options.watch_multiple.split(",")]
+    watch_sessions = [int(n) for n in options.watch_sessions.split(",")]
+except ValueError:
+    parser.error("invalid --watch_multiple or --watch_sessions")
+if min(watch_multiples) < 1 or min(watch_sessions) < 1:
+    parser.error("--watch_multiple and --watch_sessions must be positive")
+options.watch_multiple = watch_multiples[0]
+fanout_sweep = (len(watch_multiples) > 1 or len(watch_sessions) > 1 or
+                watch_sessions[0] > 1)
+if fanout_sweep and (len(sizes) > 1 or "," in options.max_outstanding or
+                     options.clients > 1 or options.processes > 1 or
+                     options.batch_size or options.workload):
+    parser.error("the watch fan-out sweep runs on its own, on a single session and window")
+
+if options.backend == "fake" and options.processes > 1:
+    parser.error("the fake backend lives in one process, it can't serve --processes")
+if options.batch_size < 0:
+    parser.error("--batch_size must not be negative")
+if options.batch_size and (options.clients > 1 or options.processes > 1 or
+                           "," in options.max_outstanding):
+    parser.error("--batch_size runs on a single session and window")
+if (options.clients > 1 or options.processes > 1) and \
+        "," in options.max_outstanding:
+    parser.error("the --max_outstanding sweep runs on a single session")
+
+workload = None
+if options.workload:
+    try:
+        workload = Workload.parse(options.workload, options.znode_count,
+                                  options.znode_size)
+    except WorkloadError, e:
+        parser.error(e.value)
+    if options.clients > 1 or options.processes > 1:
+        parser.error("--workload runs on a single session")
+
 zkclient.options = options
+zookeeper = zkclient.use_backend(options.backend, options.fake_latency)
 
 zookeeper.set_log_stream(open("cli_log_%d.txt" % (os.getpid()),"w"))
 
@@ -77,266 +176,842 @@ class SmokeError(Exception):
     def __str__(self):
         return repr(self.value)
 
-def print_elap(start, msg, count):
-    elapms = (time.time() - start) * 1000
+class Payload(object):
+    """Data of the znodes of one size, built once and shared by all the
+    requests. Results are checked by length and digest."""
+    def __init__(self, size):
+        self.size = size
+        self.data = size * "x"
+        self.digest = hashlib.md5(self.data).digest()
+
+    def matches(self, value):
+        return (value is not None and len(value) == self.size and
+                hashlib.md5(value).digest() == self.digest)
+
+def print_elap(start, msg, count, end=None):
+    if end is None:
+        end = clock.now()
+    elapms = (end - start) * 1000
     if int(elapms) != 0:
         print("%s in %6d ms (%f ms/op %f/sec)"
               % (msg, int(elapms), elapms/count, count/(elapms/1000.0)))
     else:
         print("%s in %6d ms (included in prior)" % (msg, int(elapms)))
 
-def timer(ops, msg, count=options.znode_count, name="kvm_event"):
+def print_latencies(latencies):
+    if latencies.count:
+        print("        latency %s" % (latencies.summary()))
+
+# a send later than this on the --rate schedule is reported as late
+LATE_USEC = 1000
+
+def print_lags(lags):
+    """how far behind the --rate schedule the requests were sent"""
+    if lags.count:
+        late = lags.count_above(LATE_USEC)
+        print("        behind schedule %s, %d sends (%.1f%%) late by over %d ms"
+              % (lags.summary(), late, 100.0 * late / lags.count,
+                 LATE_USEC / 1000))
+
+def schedule(share=1.0):
+    """the --rate schedule of a session sending share of the requests
+    of a phase, None when running closed loop"""
+    if not options.rate:
+        return None
+    return zkclient.Schedule(options.rate * share,
+                             options.arrivals == "poisson")
+
+def timer(ops, msg, count=options.znode_count, name="kvm_event", recorder=None):
     # CUONG - begin
     logger = log_kvm_event(name)
     # CUONG - end
 
-    start = time.time()
+    if recorder is not None:
+        recorder.reset()
+    start = clock.now()
     for op in ops:
         pass
+    end = clock.now()
 
     # CUONG - begin
     stop_logging(name)
     # CUONG - end
 
-    print_elap(start, msg, count)
+    print_elap(start, msg, count, end)
+    if recorder is not None:
+        for op, latencies in sorted(recorder.histograms.items()):
+            print_latencies(latencies)
+        if recorder.keep_samples:
+            with open(options.log_dir + "/" + name + "_latencies.txt", "w") as fp:
+                recorder.dump(fp)
+    return count / max(end - start, 1e-9)
 
 def timer2(func, msg, count=options.znode_count, name="kvm_event"):
+    """func(latencies, lags) records the latency of each request, and
+    with --rate how late it was sent, in the histograms it is given"""
+    latencies = LatencyHistogram(keep_samples=options.dump_latencies)
+    lags = LatencyHistogram()
+
     # CUONG - begin
     logger = log_kvm_event(name)
     # CUONG - end
 
-    start = time.time()
-    func()
+    start = clock.now()
+    func(latencies, lags)
+    end = clock.now()
 
     # CUONG - begin
     stop_logging(name)
     # CUONG - end
 
-    print_elap(start, msg, count)
+    print_elap(start, msg, count, end)
+    print_latencies(latencies)
+    print_lags(lags)
+    if latencies.samples is not None:
+        with open(options.log_dir + "/" + name + "_latencies.txt", "w") as fp:
+            dump_samples(fp, name, latencies.samples)
+    return count / max(end - start, 1e-9)
 
 def child_path(i):
     return "%s/session_%d" % (options.root_znode, i)
 
 # CUONG - begin
+# only a trace pipe given explicitly has to be there
+trace_reader = TracePipeReader(options.trace_pipe or TRACE_PIPE,
+                               ("kvm_", clock.MARKER),
+                               required=options.trace_pipe is not None)
+trace_clock = clock.TraceClock(options.trace_marker)
+
 def start_kvm_trace():
     subprocess.call("sudo /home/depend/bin/enable_trace_kvm.sh 1", shell=True)
+    trace_reader.start()
+    if not trace_reader.enabled():
+        print("warning: %s not found, the kvm events are not captured" %
+              (trace_reader.path))
 
 def stop_kvm_trace():
+    trace_reader.stop()
+    if trace_clock.marks and options.verbose:
+        print("%d clock markers written, in up to %d usec" %
+              (trace_clock.marks, trace_clock.error_ns // 1000))
+    trace_clock.close()
     subprocess.call("sudo /home/depend/bin/enable_trace_kvm.sh 0", shell=True)
 
-def flush_trace_pipe():
-    cmd = "sudo cat /sys/kernel/debug/tracing/trace_pipe > /dev/null"
-    subprocess.Popen(cmd, shell=True)
-    sleep(5)
-    stop_logging(None)
-
 def log_kvm_event(sec_name):
-    flush_trace_pipe()
-
     # log ifstat
     out_file = options.log_dir + "/" + sec_name + ".txt"
     cmd = "sudo virsh domifstat os_u1204_1 vnet0 > " + out_file
     subprocess.call(cmd, shell=True)
 
-    cmd = "sudo cat /sys/kernel/debug/tracing/trace_pipe | grep kvm_ >> "
-    cmd += out_file
-
-    return subprocess.Popen(cmd, shell=True)
+    trace_reader.begin(out_file)
+    trace_clock.mark("begin", sec_name)
+    return trace_reader
 
 def stop_logging(sec_name):
-    # print "stop logging."
-    cmd = "sudo kill -9 `pgrep cat`"
-    subprocess.call(cmd, shell=True)
+    trace_clock.mark("end", sec_name)
+    trace_reader.end()
 
-    if sec_name:
-        # log ifstat
-        out_file = options.log_dir + "/" + sec_name + ".txt"
-        cmd = "sudo virsh domifstat os_u1204_1 vnet0 >> " + out_file
-        subprocess.call(cmd, shell=True)
+    # log ifstat
+    out_file = options.log_dir + "/" + sec_name + ".txt"
+    cmd = "sudo virsh domifstat os_u1204_1 vnet0 >> " + out_file
+    subprocess.call(cmd, shell=True)
 
 # CUONG - end
 
-def synchronous_latency_test(s, data):
+def synchronous_latency_test(s, payload, suffix=""):
+    """returns the requests/sec of each phase"""
+    data = payload.data
+    rates = {}
+
     # create znode_count znodes (perm)
-    timer((s.create(child_path(j), data)
-           for j in xrange(options.znode_count)),
-          "created %7d permanent znodes " % (options.znode_count),
-          name="created")
+    rates["created"] = timer((s.create(child_path(j), data)
+                              for j in xrange(options.znode_count)),
+                             "created %7d permanent znodes " % (options.znode_count),
+                             recorder=s.recorder, name="created" + suffix)
 
     # set znode_count znodes
-    timer((s.set(child_path(j), data)
-           for j in xrange(options.znode_count)),
-          "set     %7d permanent znodes " % (options.znode_count),
-          name="set")
+    rates["set"] = timer((s.set(child_path(j), data)
+                          for j in xrange(options.znode_count)),
+                         "set     %7d permanent znodes " % (options.znode_count),
+                         recorder=s.recorder, name="set" + suffix)
 
     # get znode_count znodes
-    timer((s.get(child_path(j))
-           for j in xrange(options.znode_count)),
-          "get     %7d permanent znodes " % (options.znode_count),
-          name="get")
+    rates["get"] = timer((s.get(child_path(j))
+                          for j in xrange(options.znode_count)),
+                         "get     %7d permanent znodes " % (options.znode_count),
+                         recorder=s.recorder, name="get" + suffix)
 
     # delete znode_count znodes
-    timer((s.delete(child_path(j))
-           for j in xrange(options.znode_count)),
-          "deleted %7d permanent znodes " % (options.znode_count),
-          name="deleted")
+    rates["deleted"] = timer((s.delete(child_path(j))
+                              for j in xrange(options.znode_count)),
+                             "deleted %7d permanent znodes " % (options.znode_count),
+                             recorder=s.recorder, name="deleted" + suffix)
 
     # create znode_count znodes (ephemeral)
-    timer((s.create(child_path(j), data, zookeeper.EPHEMERAL)
-           for j in xrange(options.znode_count)),
-          "created %7d ephemeral znodes " % (options.znode_count),
-          name="created_eph")
+    rates["created_eph"] = timer((s.create(child_path(j), data, zookeeper.EPHEMERAL)
+                                  for j in xrange(options.znode_count)),
+                                 "created %7d ephemeral znodes " % (options.znode_count),
+                                 recorder=s.recorder, name="created_eph" + suffix)
 
     # watch znode_count znodes
-    watches = [CountingWatcher() for x in xrange(options.watch_multiple)]
+    notifications = NotificationLatencies()
+    watches = [TimedWatcher(notifications) for x in xrange(options.watch_multiple)]
     def watch(j):
         for watch in watches:
             s.exists(child_path(j), watch)
-    timer((watch(j) for j in xrange(options.znode_count)),
-          "watched %7d ephemeral znodes " %
-          (options.watch_multiple * options.znode_count),
-          options.watch_multiple * options.znode_count,
-          name="watched_eph")
+    rates["watched_eph"] = timer((watch(j) for j in xrange(options.znode_count)),
+                                 "watched %7d ephemeral znodes " %
+                                 (options.watch_multiple * options.znode_count),
+                                 options.watch_multiple * options.znode_count,
+                                 recorder=s.recorder, name="watched_eph" + suffix)
 
     # delete znode_count znodes
-    timer((s.delete(child_path(j))
-           for j in xrange(options.znode_count)),
-          "deleted %7d ephemeral znodes " % (options.znode_count),
-          name="deleted_eph")
-
-    start = time.time()
-    for watch in watches:
-        if watch.waitForExpected(options.znode_count, 60000) != options.znode_count:
-            raise SmokeError("wrong number of watches: %d" %
-                             (watch.count))
-
-    print_elap(start,
-               "notif   %7d           watches" % (options.watch_multiple * options.znode_count),
-               (options.watch_multiple * options.znode_count))
+    rates["deleted_eph"] = timer((s.delete(notifications.deleting(child_path(j)))
+                                  for j in xrange(options.znode_count)),
+                                 "deleted %7d ephemeral znodes " % (options.znode_count),
+                                 recorder=s.recorder, name="deleted_eph" + suffix)
+
+    start = clock.now()
+    wait_notifications(watches, options.znode_count)
+    print_notif(start, notifications.latencies)
+    return rates
+
+def asynchronous_latency_test(s, payload, max_outstanding=0, suffix=""):
+    """returns the requests/sec of each phase"""
+    data = payload.data
+    pipeline = zkclient.Pipeline(max_outstanding, schedule())
+    rates = {}
+
+    def check_path(j, path):
+        if path != child_path(j):
+            raise SmokeError("invalid path %s for operation %d on handle %d" %
+                             (path, j, s.handle))
 
-def asynchronous_latency_test(s, data):
     # create znode_count znodes (perm)
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.CreateCallback()
-            cb.cv.acquire()
-            s.acreate(child_path(j), cb, data)
-            callbacks.append(cb)
-
-        for j, cb in enumerate(callbacks):
-            cb.waitForSuccess()
-            if cb.path != child_path(j):
-                raise SmokeError("invalid path %s for operation %d on handle %d" %
-                                 (cb.path, j, cb.handle))
-
-    timer2(func, "created %7d permanent znodes " % (options.znode_count), name="created")
+    def func(latencies, lags):
+        pipeline.run(options.znode_count,
+                     lambda j, cb: s.acreate(child_path(j), cb, data),
+                     check_path, latencies, lags)
 
-    # set znode_count znodes
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.SetCallback()
-            cb.cv.acquire()
-            s.aset(child_path(j), cb, data)
-            callbacks.append(cb)
+    rates["created"] = timer2(func, "created %7d permanent znodes " % (options.znode_count), name="created" + suffix)
 
-        for cb in callbacks:
-            cb.waitForSuccess()
+    # set znode_count znodes
+    def func(latencies, lags):
+        pipeline.run(options.znode_count,
+                     lambda j, cb: s.aset(child_path(j), cb, data),
+                     None, latencies, lags)
 
-    timer2(func, "set     %7d permanent znodes " % (options.znode_count), name="set")
+    rates["set"] = timer2(func, "set     %7d permanent znodes " % (options.znode_count), name="set" + suffix)
 
     # get znode_count znodes
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.GetCallback()
-            cb.cv.acquire()
-            s.aget(child_path(j), cb)
-            callbacks.append(cb)
+    def check_data(j, value, stat):
+        if not payload.matches(value):
+            raise SmokeError("invalid data of %d bytes for operation %d on handle %d" %
+                             (len(value or ""), j, s.handle))
 
-        for cb in callbacks:
-            cb.waitForSuccess()
-            if cb.value != data:
-                raise SmokeError("invalid data %s for operation %d on handle %d" %
-                                 (cb.value, j, cb.handle))
+    def func(latencies, lags):
+        pipeline.run(options.znode_count,
+                     lambda j, cb: s.aget(child_path(j), cb),
+                     check_data, latencies, lags)
 
-    timer2(func, "get     %7d permanent znodes " % (options.znode_count), name="get")
+    rates["get"] = timer2(func, "get     %7d permanent znodes " % (options.znode_count), name="get" + suffix)
 
 
     # delete znode_count znodes (perm)
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.DeleteCallback()
-            cb.cv.acquire()
-            s.adelete(child_path(j), cb)
-            callbacks.append(cb)
+    def func(latencies, lags):
+        pipeline.run(options.znode_count,
+                     lambda j, cb: s.adelete(child_path(j), cb),
+                     None, latencies, lags)
 
-        for cb in callbacks:
-            cb.waitForSuccess()
-
-    timer2(func, "deleted %7d permanent znodes " % (options.znode_count), name="deleted")
+    rates["deleted"] = timer2(func, "deleted %7d permanent znodes " % (options.znode_count), name="deleted" + suffix)
 
     # create znode_count znodes (ephemeral)
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.CreateCallback()
-            cb.cv.acquire()
-            s.acreate(child_path(j), cb, data, zookeeper.EPHEMERAL)
-            callbacks.append(cb)
-
-        for j, cb in enumerate(callbacks):
-            cb.waitForSuccess()
-            if cb.path != child_path(j):
-                raise SmokeError("invalid path %s for operation %d on handle %d" %
-                                 (cb.path, j, cb.handle))
+    def func(latencies, lags):
+        pipeline.run(options.znode_count,
+                     lambda j, cb: s.acreate(child_path(j), cb, data, zookeeper.EPHEMERAL),
+                     check_path, latencies, lags)
 
-    timer2(func, "created %7d ephemeral znodes " % (options.znode_count), name="created_eph")
+    rates["created_eph"] = timer2(func, "created %7d ephemeral znodes " % (options.znode_count), name="created_eph" + suffix)
 
-    watches = [CountingWatcher() for x in xrange(options.watch_multiple)]
+    notifications = NotificationLatencies()
+    watches = [TimedWatcher(notifications) for x in xrange(options.watch_multiple)]
 
     # watched znode_count znodes
-    def func():
-        callbacks = []
-        for watch in watches:
-            for j in xrange(options.znode_count):
-                cb = zkclient.ExistsCallback()
-                cb.cv.acquire()
-                s.aexists(child_path(j), cb, watch)
-                callbacks.append(cb)
+    def watch(j, cb):
+        w, j = divmod(j, options.znode_count)
+        s.aexists(child_path(j), cb, watches[w])
 
-        for cb in callbacks:
-            cb.waitForSuccess()
+    def func(latencies, lags):
+        pipeline.run(options.watch_multiple * options.znode_count,
+                     watch, None, latencies, lags)
 
-    timer2(func, "watched %7d ephemeral znodes " %
+    rates["watched_eph"] = timer2(func, "watched %7d ephemeral znodes " %
            (options.watch_multiple * options.znode_count),
            options.watch_multiple * options.znode_count,
-           name="watchd_eph")
+           name="watchd_eph" + suffix)
 
     # delete znode_count znodes (ephemeral)
-    def func():
-        callbacks = []
-        for j in xrange(options.znode_count):
-            cb = zkclient.DeleteCallback()
-            cb.cv.acquire()
-            s.adelete(child_path(j), cb)
-            callbacks.append(cb)
-
-        for cb in callbacks:
-            cb.waitForSuccess()
-
-    timer2(func, "deleted %7d ephemeral znodes " % (options.znode_count), name="deleted_eph")
-
-    start = time.time()
-    for watch in watches:
-        if watch.waitForExpected(options.znode_count, 60000) != options.znode_count:
-            raise SmokeError("wrong number of watches: %d" %
-                             (watch.count))
+    def func(latencies, lags):
+        pipeline.run(options.znode_count,
+                     lambda j, cb: s.adelete(notifications.deleting(child_path(j)), cb),
+                     None, latencies, lags)
+
+    rates["deleted_eph"] = timer2(func, "deleted %7d ephemeral znodes " % (options.znode_count), name="deleted_eph" + suffix)
+
+    start = clock.now()
+    wait_notifications(watches, options.znode_count)
+    print_notif(start, notifications.latencies)
+    return rates
+
+BATCHED_PHASES = ["batch_created", "batch_set", "batch_deleted"]
+
+def batched_latency_test(s, payload, batch_size, max_outstanding=0, suffix=""):
+    """Create, set and delete the znodes in batches of batch_size
+    operations, returns the logical requests/sec of each phase"""
+    data = payload.data
+    count = options.znode_count
+    batches = (count + batch_size - 1) // batch_size
+    pipeline = zkclient.Pipeline(max_outstanding)
+    rates = {}
+
+    def batch(b, add):
+        batch = zkclient.Batch()
+        for j in xrange(b * batch_size, min((b + 1) * batch_size, count)):
+            add(batch, child_path(j))
+        return batch
+
+    for name, add in [("batch_created", lambda b, path: b.create(path, data)),
+                      ("batch_set", lambda b, path: b.set(path, data)),
+                      ("batch_deleted", lambda b, path: b.delete(path))]:
+        msg = "%-13s %7d permanent znodes in batches of %d" % (name, count, batch_size)
+        if options.synchronous:
+            rates[name] = timer((s.multi(batch(b, add)) for b in xrange(batches)),
+                                msg, count, recorder=s.recorder,
+                                name=name + suffix)
+        else:
+            def func(latencies, lags, add=add):
+                pipeline.run(batches,
+                             lambda b, cb: s.amulti(batch(b, add), cb),
+                             None, latencies, lags)
+            rates[name] = timer2(func, msg, count, name=name + suffix)
+    return rates
+
+def run_clients(sessions, work, counts, started):
+    """Run work(k, s, latencies, lags) for each session k in its own thread,
+    the share of session k being counts[k] requests. The threads start
+    together once started() returns.
+
+    Returns start, end, the latencies, lags and elapsed time of each
+    session and the errors raised.
+    """
+    n = len(sessions)
+    barrier = zkclient.Barrier(n + 1)
+    latencies = [LatencyHistogram() for k in xrange(n)]
+    lags = [LatencyHistogram() for k in xrange(n)]
+    elapsed = [0.0] * n
+    errors = []
+
+    def client(k):
+        s = sessions[k]
+        s.recorder.reset()
+        barrier.wait()
+        start = clock.now()
+        try:
+            work(k, s, latencies[k], lags[k])
+        except Exception, e:
+            errors.append(e)
+        elapsed[k] = clock.now() - start
+        for h in s.recorder.histograms.values():
+            latencies[k].merge(h)
+
+    threads = [threading.Thread(target=client, args=(k,)) for k in xrange(n)]
+    for t in threads:
+        t.start()
+
+    started()
+    barrier.wait()
+    start = clock.now()
+    for t in threads:
+        t.join()
+    end = clock.now()
+
+    return start, end, latencies, lags, elapsed, errors
+
+def merge_latencies(histograms):
+    total = LatencyHistogram()
+    for h in histograms:
+        total.merge(h)
+    return total
+
+def print_clients(label, counts, elapsed):
+    for k in xrange(len(counts)):
+        elapms = elapsed[k] * 1000
+        print("        %s %3d %7d ops in %6d ms (%f/sec)"
+              % (label, k, counts[k], int(elapms), counts[k]/max(elapms/1000.0, 1e-9)))
+
+def run_concurrent(sessions, phase, suffix=""):
+    """Run a phase on all the sessions at the same time, returns its
+    requests/sec"""
+    name, msg, count, work, counts = phase
+    name += suffix
+
+    # CUONG - begin
+    start, end, latencies, lags, elapsed, errors = run_clients(
+        sessions, work, counts, lambda: log_kvm_event(name))
+    stop_logging(name)
+    # CUONG - end
+
+    if errors:
+        raise errors[0]
+
+    print_elap(start, msg, count, end)
+    print_latencies(merge_latencies(latencies))
+    print_lags(merge_latencies(lags))
+    print_clients("client", counts, elapsed)
+    return count / max(end - start, 1e-9)
+
+def concurrent_phases(sessions, payload, keys, max_outstanding=0):
+    """The phases of the test for sessions sharing the znodes, keys[k]
+    are the znodes of session k.
+
+    Returns a list of (name, msg, count, work, counts) and a function
+    waiting for the watches set by the sessions.
+    """
+    n = len(sessions)
+    data = payload.data
+    counts = [len(keys[k]) for k in xrange(n)]
+    pipelines = [zkclient.Pipeline(max_outstanding,
+                                   schedule(float(counts[k]) / options.znode_count))
+                 for k in xrange(n)]
+
+    def phase(async_op, sync_op, check=None):
+        def work(k, s, latencies, lags):
+            if options.synchronous:
+                for j in keys[k]:
+                    sync_op(s, j)
+            else:
+                pipelines[k].run(counts[k],
+                                 lambda i, cb: async_op(s, keys[k][i], cb),
+                                 check and (lambda i, *result: check(s, keys[k][i], *result)),
+                                 latencies, lags)
+        return work
+
+    def check_path(s, j, path):
+        if path != child_path(j):
+            raise SmokeError("invalid path %s for operation %d on handle %d" %
+                             (path, j, s.handle))
+
+    def check_data(s, j, value, stat):
+        if not payload.matches(value):
+            raise SmokeError("invalid data of %d bytes for operation %d on handle %d" %
+                             (len(value or ""), j, s.handle))
+
+    phases = []
+    phases.append(("created",
+                   "created %7d permanent znodes " % (options.znode_count),
+                   options.znode_count,
+                   phase(lambda s, j, cb: s.acreate(child_path(j), cb, data),
+                         lambda s, j: s.create(child_path(j), data),
+                         check_path),
+                   counts))
+
+    phases.append(("set",
+                   "set     %7d permanent znodes " % (options.znode_count),
+                   options.znode_count,
+                   phase(lambda s, j, cb: s.aset(child_path(j), cb, data),
+                         lambda s, j: s.set(child_path(j), data)),
+                   counts))
+
+    phases.append(("get",
+                   "get     %7d permanent znodes " % (options.znode_count),
+                   options.znode_count,
+                   phase(lambda s, j, cb: s.aget(child_path(j), cb),
+                         lambda s, j: s.get(child_path(j)),
+                         check_data),
+                   counts))
+
+    phases.append(("deleted",
+                   "deleted %7d permanent znodes " % (options.znode_count),
+                   options.znode_count,
+                   phase(lambda s, j, cb: s.adelete(child_path(j), cb),
+                         lambda s, j: s.delete(child_path(j))),
+                   counts))
+
+    phases.append(("created_eph",
+                   "created %7d ephemeral znodes " % (options.znode_count),
+                   options.znode_count,
+                   phase(lambda s, j, cb: s.acreate(child_path(j), cb, data, zookeeper.EPHEMERAL),
+                         lambda s, j: s.create(child_path(j), data, zookeeper.EPHEMERAL),
+                         check_path),
+                   counts))
+
+    # each session watches its own znodes
+    notifications = NotificationLatencies()
+    watches = [[TimedWatcher(notifications) for x in xrange(options.watch_multiple)]
+               for k in xrange(n)]
+    def watch(k, s, latencies, lags):
+        if options.synchronous:
+            for w in watches[k]:
+                for j in keys[k]:
+                    s.exists(child_path(j), w)
+        else:
+            def submit(i, cb):
+                w, i = divmod(i, counts[k])
+                s.aexists(child_path(keys[k][i]), cb, watches[k][w])
+            pipelines[k].run(options.watch_multiple * counts[k], submit,
+                             None, latencies, lags)
+
+    phases.append(("watched_eph",
+                   "watched %7d ephemeral znodes " %
+                   (options.watch_multiple * options.znode_count),
+                   options.watch_multiple * options.znode_count,
+                   watch,
+                   [options.watch_multiple * c for c in counts]))
+
+    phases.append(("deleted_eph",
+                   "deleted %7d ephemeral znodes " % (options.znode_count),
+                   options.znode_count,
+                   phase(lambda s, j, cb: s.adelete(notifications.deleting(child_path(j)), cb),
+                         lambda s, j: s.delete(notifications.deleting(child_path(j)))),
+                   counts))
+
+    def wait_watches():
+        deadline = clock.now() + NOTIF_TIMEOUT
+        for k in xrange(n):
+            for watch in watches[k]:
+                if watch.waitUntil(counts[k], deadline) != counts[k]:
+                    raise SmokeError("wrong number of watches: %d" %
+                                     (watch.count))
+        return notifications.latencies
+
+    return phases, wait_watches
+
+# seconds to wait for the notifications of the deleted znodes
+NOTIF_TIMEOUT = 60
+
+def wait_notifications(watches, count):
+    """wait for the notifications of count znodes to each watcher"""
+    for c in wait_for_watchers(watches, count, NOTIF_TIMEOUT * 1000):
+        if c != count:
+            raise SmokeError("wrong number of watches: %d" % (c))
+
+def print_notif(start, latencies):
     print_elap(start,
                "notif   %7d           watches" % (options.watch_multiple * options.znode_count),
                (options.watch_multiple * options.znode_count))
+    if latencies.count:
+        print("        delete to notification %s" % (latencies.summary()))
+
+def concurrent_latency_test(sessions, payload, max_outstanding=0, suffix=""):
+    """returns the requests/sec of each phase"""
+    n = len(sessions)
+    keys = [xrange(k, options.znode_count, n) for k in xrange(n)]
+    phases, wait_watches = concurrent_phases(sessions, payload, keys,
+                                             max_outstanding)
+    rates = {}
+    for phase in phases:
+        rates[phase[0]] = run_concurrent(sessions, phase, suffix)
+
+    start = clock.now()
+    print_notif(start, wait_watches())
+    return rates
+
+def load_worker(p, conn, payloads, max_outstanding):
+    """Process p of --processes, runs its share of each phase with its
+    own sessions when the coordinator says so"""
+    n = options.clients
+    total = options.processes * n
+    try:
+        while True:
+            command = conn.recv()
+            if command is None:
+                break
+            server, size = command
+
+            sessions = [ZKClient(server, options.timeout) for k in xrange(n)]
+            keys = [xrange(p*n + k, options.znode_count, total)
+                    for k in xrange(n)]
+            phases, wait_watches = concurrent_phases(sessions, payloads[size],
+                                                     keys, max_outstanding)
+            for name, msg, count, work, counts in phases:
+                def started():
+                    conn.send(("ready", name, msg, count))
+                    conn.recv()
+                start, end, latencies, lags, elapsed, errors = run_clients(
+                    sessions, work, counts, started)
+                if errors:
+                    raise errors[0]
+                conn.send(("result", sum(counts), end - start,
+                           merge_latencies(latencies).to_dict(),
+                           merge_latencies(lags).to_dict()))
+
+            conn.send(("notif", wait_watches().to_dict()))
+            for s in sessions:
+                s.close()
+    except Exception, e:
+        conn.send(("error", "process %d: %s" % (p, e)))
+
+def start_workers(payloads, max_outstanding):
+    """Fork the --processes load generators, before this process has
+    any session"""
+    workers = []
+    for p in xrange(options.processes):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=load_worker,
+                                          args=(p, child_conn, payloads, max_outstanding))
+        process.daemon = True
+        process.start()
+        workers.append((process, conn))
+    return workers
+
+def stop_workers(workers):
+    for process, conn in workers:
+        conn.send(None)
+    for process, conn in workers:
+        process.join()
+
+def receive(workers):
+    messages = [conn.recv() for process, conn in workers]
+    for m in messages:
+        if m[0] == "error":
+            raise SmokeError(m[1])
+    return messages
+
+def multiprocess_latency_test(workers, server, size, suffix=""):
+    """Coordinate the phases run by the worker processes and merge
+    their latencies and timings, returns the requests/sec of each
+    phase"""
+    for process, conn in workers:
+        conn.send((server, size))
+
+    rates = {}
+    messages = receive(workers)
+    while messages[0][0] == "ready":
+        phase, msg, count = messages[0][1:]
+        name = phase + suffix
+
+        # CUONG - begin
+        logger = log_kvm_event(name)
+        # CUONG - end
+
+        start = clock.now()
+        for process, conn in workers:
+            conn.send("go")
+        results = receive(workers)
+        end = clock.now()
+
+        # CUONG - begin
+        stop_logging(name)
+        # CUONG - end
+
+        print_elap(start, msg, count, end)
+        print_latencies(merge_latencies(
+            LatencyHistogram.from_dict(r[3]) for r in results))
+        print_lags(merge_latencies(
+            LatencyHistogram.from_dict(r[4]) for r in results))
+        print_clients("process", [r[1] for r in results],
+                      [r[2] for r in results])
+        rates[phase] = count / max(end - start, 1e-9)
+
+        start = clock.now()
+        messages = receive(workers)
+
+    print_notif(start, merge_latencies(
+        LatencyHistogram.from_dict(m[1]) for m in messages))
+    return rates
+
+def bulk_phase(s, count, sync_op, async_op, msg, name, max_outstanding=0):
+    """Run sync_op(j) or async_op(j, completion) on j in 0..count-1,
+    returns the requests/sec"""
+    if options.synchronous:
+        return timer((sync_op(j) for j in xrange(count)), msg, count, name=name,
+              recorder=s.recorder)
+    else:
+        pipeline = zkclient.Pipeline(max_outstanding)
+        return timer2(lambda latencies, lags: pipeline.run(count, async_op, None,
+                                                           latencies, lags),
+                      msg, count, name=name)
+
+def mixed_workload_test(s, workload, max_outstanding=0):
+    """Create the znodes of the workload, run its mix of operations as
+    the "mixed" phase and delete the znodes"""
+    data = workload.value_size * "x"
+    count = workload.znode_count
+    n = options.workload_ops or count
+    names = workload.ops
+    ops, keys = workload.generate(n)
+    print("mixed workload: %s" % (workload.describe()))
+
+    bulk_phase(s, count,
+               lambda j: s.create(child_path(j), data),
+               lambda j, cb: s.acreate(child_path(j), cb, data),
+               "created %7d permanent znodes " % (count), "mixed_created",
+               max_outstanding)
+
+    sync_ops = {"get": lambda j: s.get(child_path(j)),
+                "set": lambda j: s.set(child_path(j), data),
+                "exists": lambda j: s.exists(child_path(j)),
+                "get_children": lambda j: s.get_children(child_path(j))}
+    async_ops = {"get": lambda j, cb: s.aget(child_path(j), cb),
+                 "set": lambda j, cb: s.aset(child_path(j), cb, data),
+                 "exists": lambda j, cb: s.aexists(child_path(j), cb),
+                 "get_children": lambda j, cb: s.aget_children(child_path(j), cb)}
+    latencies = [LatencyHistogram() for op in names]
+    lags = LatencyHistogram()
+
+    # CUONG - begin
+    logger = log_kvm_event("mixed")
+    # CUONG - end
+
+    if options.synchronous:
+        calls = [sync_ops[op] for op in names]
+        s.recorder.reset()
+        start = clock.now()
+        for i in xrange(n):
+            calls[ops[i]](keys[i])
+        end = clock.now()
+    else:
+        calls = [async_ops[op] for op in names]
+        pipeline = zkclient.Pipeline(max_outstanding, schedule())
+        start = clock.now()
+        pipeline.run(n, lambda i, cb: calls[ops[i]](keys[i], cb),
+                     None, latencies, lags, ops)
+        end = clock.now()
+
+    # CUONG - begin
+    stop_logging("mixed")
+    # CUONG - end
+
+    if options.synchronous:
+        latencies = [s.recorder.histograms.get(op, LatencyHistogram())
+                     for op in names]
+        if s.recorder.keep_samples:
+            with open(options.log_dir + "/mixed_latencies.txt", "w") as fp:
+                s.recorder.dump(fp)
+
+    print_elap(start, "mixed   %7d operations     " % (n), n, end)
+    print_latencies(merge_latencies(latencies))
+    print_lags(lags)
+    elapsed = max(end - start, 1e-9)
+    for op, h in zip(names, latencies):
+        print("        %-12s %7d ops (%f/sec) latency %s"
+              % (op, h.count, h.count / elapsed, h.summary()))
+
+    bulk_phase(s, count,
+               lambda j: s.delete(child_path(j)),
+               lambda j, cb: s.adelete(child_path(j), cb),
+               "deleted %7d permanent znodes " % (count), "mixed_deleted",
+               max_outstanding)
+
+ASYNC_PHASES = ["created", "set", "get", "deleted",
+                "created_eph", "watched_eph", "deleted_eph"]
+
+def print_sweep(title, label, values, rates):
+    print("requests/sec by %s" % (title))
+    print("%8s %s" % (label, " ".join("%11s" % (p) for p in ASYNC_PHASES)))
+    for value, r in zip(values, rates):
+        print("%8s %s" % (value or "all",
+                          " ".join("%11.1f" % (r[p]) for p in ASYNC_PHASES)))
+
+def watch_fanout_test(s, server, payload, multiple, watchers, max_outstanding=0):
+    """Put multiple watches on each znode from each of watchers sessions,
+    then delete the znodes from s. Returns the deletes/sec, the
+    notifications/sec and the delete to notification latencies."""
+    count = options.znode_count
+    total = multiple * watchers * count
+    data = payload.data
+    suffix = "_m%d_n%d" % (multiple, watchers)
+    print("%d watches on each znode from each of %d sessions" %
+          (multiple, watchers))
+
+    sessions = [ZKClient(server, options.timeout) for k in xrange(watchers)]
+    notifications = NotificationLatencies()
+    watches = [TimedWatcher(notifications) for w in xrange(multiple * watchers)]
+
+    bulk_phase(s, count,
+               lambda j: s.create(child_path(j), data),
+               lambda j, cb: s.acreate(child_path(j), cb, data),
+               "created %7d watched znodes   " % (count),
+               "fanout_created" + suffix, max_outstanding)
+
+    # watch i is set by session i / multiple
+    def watch(i, cb=None):
+        w, j = divmod(i, count)
+        if cb is None:
+            sessions[w // multiple].exists(child_path(j), watches[w])
+        else:
+            sessions[w // multiple].aexists(child_path(j), cb, watches[w])
+    bulk_phase(s, total, watch, watch,
+               "watched %7d watched znodes   " % (total),
+               "fanout_watched" + suffix, max_outstanding)
+
+    rate = bulk_phase(s, count,
+                      lambda j: s.delete(notifications.deleting(child_path(j))),
+                      lambda j, cb: s.adelete(notifications.deleting(child_path(j)), cb),
+                      "deleted %7d watched znodes   " % (count),
+                      "fanout_deleted" + suffix, max_outstanding)
+
+    start = clock.now()
+    wait_notifications(watches, count)
+    print_elap(start, "notif   %7d           watches" % (total), total)
+    print("        delete to notification %s" % (notifications.latencies.summary()))
+
+    for session in sessions:
+        session.close()
+    return rate, notifications.rate(), notifications.latencies
+
+def watch_fanout_sweep(s, server, payload, max_outstanding=0):
+    """Run watch_fanout_test for each --watch_sessions and
+    --watch_multiple and compare how the notifications scale"""
+    results = []
+    for watchers in watch_sessions:
+        for multiple in watch_multiples:
+            results.append((multiple, watchers) +
+                           watch_fanout_test(s, server, payload, multiple,
+                                             watchers, max_outstanding))
+
+    print("watch fan-out of %d deleted znodes" % (options.znode_count))
+    print("%8s %8s %9s %11s %11s %9s %9s %9s" %
+          ("multiple", "sessions", "watches", "deletes/s", "notifs/s",
+           "p50 ms", "p99 ms", "max ms"))
+    for multiple, watchers, rate, notif_rate, latencies in results:
+        print("%8d %8d %9d %11.1f %11.1f %9.3f %9.3f %9.3f" %
+              (multiple, watchers, multiple * watchers * options.znode_count,
+               rate, notif_rate, latencies.percentile(50) / 1000.0,
+               latencies.percentile(99) / 1000.0, latencies.max / 1000.0))
+
+def latency_test(s, server, payload, suffix=""):
+    """Run the phases on server with the znodes of payload, returns the
+    requests/sec of each phase"""
+    if workers:
+        print("with %d processes of %d sessions" %
+              (options.processes, options.clients))
+        return multiprocess_latency_test(workers, server, payload.size, suffix)
+    elif options.clients > 1:
+        print("with %d concurrent sessions" % (options.clients))
+        clients = [s] + [ZKClient(server, options.timeout)
+                         for k in xrange(options.clients - 1)]
+        rates = concurrent_latency_test(clients, payload, windows[0], suffix)
+        for c in clients[1:]:
+            c.close()
+        return rates
+    elif options.synchronous or len(windows) == 1:
+        if options.synchronous:
+            rates = synchronous_latency_test(s, payload, suffix)
+        else:
+            rates = asynchronous_latency_test(s, payload, windows[0], suffix)
+        if options.batch_size:
+            rates.update(batched_latency_test(s, payload, options.batch_size,
+                                              windows[0], suffix))
+        return rates
+    else:
+        rates = []
+        for window in windows:
+            print("max outstanding requests: %s" % (window or "all"))
+            rates.append(asynchronous_latency_test(s, payload, window,
+                                                   suffix + "_w%d" % (window)))
+        print_sweep("max outstanding requests", "window", windows, rates)
+        return rates[-1]
 
 def read_zk_config(filename):
     with open(filename) as f:
@@ -355,8 +1030,15 @@ def get_zk_servers(filename):
         return options.servers.split(",")
 
 if __name__ == '__main__':
-    data = options.znode_size * "x"
+    # the data of each size is shared by all the requests
+    payloads = dict((size, Payload(size)) for size in sizes)
     servers = get_zk_servers(options.configfile)
+    windows = [int(w) for w in options.max_outstanding.split(",")]
+
+    # fork the load generators before the zookeeper threads start
+    workers = None
+    if options.processes > 1:
+        workers = start_workers(payloads, windows[0])
 
     # create all the sessions first to ensure that all servers are
     # at least available & quorum has been formed. otw this will 
@@ -364,7 +1046,8 @@ if __name__ == '__main__':
     sessions = []
     # create one session to each of the servers in the ensemble
     for server in servers:
-        sessions.append(ZKClient(server, options.timeout))
+        sessions.append(ZKClient(server, options.timeout,
+                                 options.dump_latencies))
 
     # ensure root_znode doesn't exist
     if sessions[0].exists(options.root_znode):
@@ -372,9 +1055,11 @@ if __name__ == '__main__':
         if not options.force:
             raise SmokeError("Node %s already exists!" % (options.root_znode))
 
-        children = sessions[0].get_children(options.root_znode)
-        for child in children:
-            sessions[0].delete("%s/%s" % (options.root_znode, child))
+        bulk = BulkDelete(sessions[0], windows[0] or 1000,
+                          progress=not options.quiet)
+        bulk.delete(options.root_znode, keep_root=True)
+        print("deleted %d leftover znodes under %s" %
+              (bulk.deleted, options.root_znode))
     else:
         sessions[0].create(options.root_znode,
                            "smoketest root, delete after test done, created %s" %
@@ -392,16 +1077,31 @@ if __name__ == '__main__':
             type = "asynchronous"
         print("Testing latencies on server %s using %s calls" %
               (servers[i], type))
-
-        if options.synchronous:
-            synchronous_latency_test(s, data)
+        if options.rate:
+            print("open loop at %g requests/sec, %s arrivals" %
+                  (options.rate, options.arrivals))
+
+        if workload:
+            mixed_workload_test(s, workload, windows[0])
+        elif fanout_sweep:
+            watch_fanout_sweep(s, servers[i], payloads[sizes[0]], windows[0])
+        elif len(sizes) == 1:
+            latency_test(s, servers[i], payloads[sizes[0]])
         else:
-            asynchronous_latency_test(s, data)
+            rates = []
+            for size in sizes:
+                print("znode size: %d bytes" % (size))
+                rates.append(latency_test(s, servers[i], payloads[size],
+                                          "_s%d" % (size)))
+            print_sweep("znode size in bytes", "size", sizes, rates)
 
     # CUONG - begin
     stop_kvm_trace()
     # CUONG - end
 
+    if workers:
+        stop_workers(workers)
+
     sessions[0].delete(options.root_znode)
 
     # close sessions
@@ -20,7 +20,8 @@ import datetime, os
 from optparse import OptionParser
 
 import zkclient
-from zkclient import ZKClient, SequentialCountingWatcher, zookeeper
+from zkclient import ZKClient, SequentialCountingWatcher, wait_for_watchers, \
+    zookeeper
 
 usage = "usage: %prog [options]"
 parser = OptionParser(usage=usage)
@@ -31,6 +32,12 @@ parser.add_option("", "--config",
                   help="zookeeper configuration file to lookup servers from")
 parser.add_option("", "--timeout", dest="timeout", type="int",
                   default=5000, help="session timeout in milliseconds (default %default)")
+parser.add_option("", "--backend", dest="backend", type="choice",
+                  choices=sorted(zkclient.BACKENDS), default=zkclient.DEFAULT_BACKEND,
+                  help="ZooKeeper binding: native, the in-process fake or the pure-python wire client (default %default, or $ZK_BACKEND)")
+parser.add_option("", "--fake_latency", dest="fake_latency", type="float",
+                  default=None, help="latency in ms the fake backend adds to each request (default $FAKEZK_LATENCY_MS or 0)")
+
 parser.add_option("-v", "--verbose",
                   action="store_true", dest="verbose", default=False,
                   help="verbose output, include more detail")
@@ -41,6 +48,7 @@ parser.add_option("-q", "--quiet",
 (options, args) = parser.parse_args()
 
 zkclient.options = options
+zookeeper = zkclient.use_backend(options.backend, options.fake_latency)
 
 zookeeper.set_log_stream(open("cli_log_%d.txt" % (os.getpid()),"w"))
 
@@ -128,12 +136,14 @@ if __name__ == '__main__':
         sessions[i].delete(child_path(i))
 
     # check all watches fired
-    for i, watcher in enumerate(watchers):
+    for i, server in enumerate(servers):
         # ensure this server is up to date with leader
         sessions[i].async()
-        if watcher.waitForExpected(len(sessions), options.timeout) != len(sessions):
+    counts = wait_for_watchers(watchers, len(sessions), options.timeout)
+    for i, server in enumerate(servers):
+        if counts[i] != len(sessions):
             raise SmokeError("server %s wrong number of watches: %d" %
-                             (server, watcher.count))
+                             (server, counts[i]))
 
     # close sessions
     for i, server in enumerate(servers):
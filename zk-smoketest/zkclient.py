@@ -14,7 +14,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import zookeeper, time, threading
+import os, time, threading, random
+
+import clock
+from latency import LatencyHistogram, LatencyRecorder
 
 DEFAULT_TIMEOUT = 30000
 
@@ -26,16 +29,43 @@ class ZKClientError(Exception):
     def __str__(self):
         return repr(self.value)
 
+# the ZooKeeper binding, the native zkpython module or the in-process
+# fake of fakezk.py to run the harness without a server
+BACKENDS = {"native": "zookeeper", "fake": "fakezk", "wire": "zkwire"}
+
+DEFAULT_BACKEND = os.environ.get("ZK_BACKEND", "native")
+
+zookeeper = None
+
+def use_backend(name, latency=None):
+    """Switch the binding of all the clients, latency is the delay in
+    ms the fake one injects in each request"""
+    global zookeeper
+    if name not in BACKENDS:
+        raise ZKClientError("unknown backend %s" % (name))
+    zookeeper = __import__(BACKENDS[name])
+    if name == "fake" and latency is not None:
+        zookeeper.set_latency(latency)
+    return zookeeper
+
+try:
+    use_backend(DEFAULT_BACKEND)
+except ImportError:
+    # the scripts pick their backend once their options are parsed
+    pass
+
 class ZKClient(object):
-    def __init__(self, servers, timeout=DEFAULT_TIMEOUT):
+    def __init__(self, servers, timeout=DEFAULT_TIMEOUT, keep_samples=False):
         self.timeout = timeout
         self.connected = False
         self.conn_cv = threading.Condition( )
         self.handle = -1
+        # latency of every synchronous call
+        self.recorder = LatencyRecorder(keep_samples)
 
         self.conn_cv.acquire()
         if not options.quiet: print("Connecting to %s" % (servers))
-        start = time.time()
+        start = clock.now()
         self.handle = zookeeper.init(servers, self.connection_watcher, timeout)
         self.conn_cv.wait(timeout/1000)
         self.conn_cv.release()
@@ -45,7 +75,7 @@ class ZKClient(object):
 
         if not options.quiet:
             print("Connected in %d ms, handle is %d"
-                  % (int((time.time() - start) * 1000), self.handle))
+                  % (int((clock.now() - start) * 1000), self.handle))
 
     def connection_watcher(self, h, type, state, path):
         self.handle = h
@@ -58,36 +88,55 @@ class ZKClient(object):
         return zookeeper.close(self.handle)
     
     def create(self, path, data="", flags=0, acl=[ZOO_OPEN_ACL_UNSAFE]):
-        start = time.time()
+        start = clock.now()
         result = zookeeper.create(self.handle, path, data, acl, flags)
+        end = clock.now()
+        self.recorder.record('create', start, end)
         if options.verbose:
             print("Node %s created in %d ms"
-                  % (path, int((time.time() - start) * 1000)))
+                  % (path, int((end - start) * 1000)))
         return result
 
     def delete(self, path, version=-1):
-        start = time.time()
+        start = clock.now()
         result = zookeeper.delete(self.handle, path, version)
+        end = clock.now()
+        self.recorder.record('delete', start, end)
         if options.verbose:
             print("Node %s deleted in %d ms"
-                  % (path, int((time.time() - start) * 1000)))
+                  % (path, int((end - start) * 1000)))
         return result
 
     def get(self, path, watcher=None):
-        return zookeeper.get(self.handle, path, watcher)
+        start = clock.now()
+        result = zookeeper.get(self.handle, path, watcher)
+        self.recorder.record('get', start, clock.now())
+        return result
 
     def exists(self, path, watcher=None):
-        return zookeeper.exists(self.handle, path, watcher)
+        start = clock.now()
+        result = zookeeper.exists(self.handle, path, watcher)
+        self.recorder.record('exists', start, clock.now())
+        return result
 
     def set(self, path, data="", version=-1):
-        return zookeeper.set(self.handle, path, data, version)
+        start = clock.now()
+        result = zookeeper.set(self.handle, path, data, version)
+        self.recorder.record('set', start, clock.now())
+        return result
 
     def set2(self, path, data="", version=-1):
-        return zookeeper.set2(self.handle, path, data, version)
+        start = clock.now()
+        result = zookeeper.set2(self.handle, path, data, version)
+        self.recorder.record('set2', start, clock.now())
+        return result
 
 
     def get_children(self, path, watcher=None):
-        return zookeeper.get_children(self.handle, path, watcher)
+        start = clock.now()
+        result = zookeeper.get_children(self.handle, path, watcher)
+        self.recorder.record('get_children', start, clock.now())
+        return result
 
     def async(self, path = "/"):
         return zookeeper.async(self.handle, path)
@@ -108,12 +157,96 @@ class ZKClient(object):
     def aset(self, path, callback, data="", version=-1):
         return zookeeper.aset(self.handle, path, data, version, callback)
 
+    def aget_children(self, path, callback, watcher=None):
+        return zookeeper.aget_children(self.handle, path, watcher, callback)
+
+    def multi(self, batch):
+        """Run the operations of batch, returns the result of each"""
+        callback = MultiCallback()
+        start = clock.now()
+        self.amulti(batch, callback)
+        callback.waitForSuccess()
+        self.recorder.record('multi', start, clock.now())
+        return callback.results
+
+    def amulti(self, batch, callback):
+        """Send the operations of batch back to back, callback(handle,
+        rc, results) is called once they have all completed with the
+        first error and the result of each operation.
+
+        The python binding has no multi, so the batch is emulated over
+        the asynchronous calls: it saves the waits between requests but
+        unlike a ZooKeeper transaction it isn't atomic.
+        """
+        count = len(batch.ops)
+        if count == 0:
+            callback(self.handle, zookeeper.OK, [])
+            return
+        results = [None] * count
+        state = {'pending': count, 'rc': zookeeper.OK}
+        lock = threading.Lock()
+
+        def completion(i):
+            def completion(handle, rc, *result):
+                lock.acquire()
+                results[i] = result
+                if rc != zookeeper.OK and state['rc'] == zookeeper.OK:
+                    state['rc'] = rc
+                state['pending'] -= 1
+                done = state['pending'] == 0
+                lock.release()
+                if done:
+                    callback(handle, state['rc'], results)
+            return completion
+
+        for i, op in enumerate(batch.ops):
+            kind, path, args = op[0], op[1], op[2:]
+            if kind == "create":
+                data, flags, acl = args
+                zookeeper.acreate(self.handle, path, data, acl, flags,
+                                  completion(i))
+            elif kind == "set":
+                data, version = args
+                zookeeper.aset(self.handle, path, data, version, completion(i))
+            else:
+                version, = args
+                zookeeper.adelete(self.handle, path, version, completion(i))
+
+class Batch(object):
+    """Operations sent together by ZKClient.multi/amulti, e.g.
+
+        batch = Batch()
+        batch.create(path, data)
+        batch.set(other, data)
+        batch.delete(old)
+    """
+    def __init__(self):
+        self.ops = []
+
+    def __len__(self):
+        return len(self.ops)
+
+    def create(self, path, data="", flags=0, acl=[ZOO_OPEN_ACL_UNSAFE]):
+        self.ops.append(("create", path, data, flags, acl))
+        return self
+
+    def set(self, path, data="", version=-1):
+        self.ops.append(("set", path, data, version))
+        return self
+
+    def delete(self, path, version=-1):
+        self.ops.append(("delete", path, version))
+        return self
+
 watch_count = 0
 
 """Callable watcher that counts the number of notifications"""
 class CountingWatcher(object):
     def __init__(self):
         self.count = 0
+        self.cv = threading.Condition(threading.Lock())
+        # count a waiter is waiting for, None when no one waits
+        self.expected = None
         global watch_count
         self.id = watch_count
         watch_count += 1
@@ -126,20 +259,38 @@ class CountingWatcher(object):
         - `count`: expected count
         - `maxwait`: max milliseconds to wait
         """
-        waited = 0
-        while (waited < maxwait):
-            if self.count >= count:
-                return self.count
-            time.sleep(1.0);
-            waited += 1000
+        return self.waitUntil(count, clock.now() + maxwait / 1000.0)
+
+    def waitUntil(self, count, deadline):
+        """waitForExpected until the time deadline"""
+        self.cv.acquire()
+        self.expected = count
+        while self.count < count:
+            remaining = deadline - clock.now()
+            if remaining <= 0:
+                break
+            self.cv.wait(remaining)
+        self.expected = None
+        self.cv.release()
         return self.count
 
     def __call__(self, handle, typ, state, path):
+        self.cv.acquire()
         self.count += 1
+        if self.expected is not None and self.count >= self.expected:
+            self.cv.notify()
+        self.cv.release()
         if options.verbose:
             print("handle %d got watch for %s in watcher %d, count %d" %
                   (handle, path, self.id, self.count))
 
+def wait_for_watchers(watchers, count, maxwait):
+    """Wait up to maxwait milliseconds in all for each of watchers to
+    count count notifications, returns their counts whether or not
+    maxwait reached"""
+    deadline = clock.now() + maxwait / 1000.0
+    return [w.waitUntil(count, deadline) for w in watchers]
+
 """Callable watcher that counts the number of notifications
 and verifies that the paths are sequential"""
 class SequentialCountingWatcher(CountingWatcher):
@@ -152,71 +303,392 @@ class SequentialCountingWatcher(CountingWatcher):
             raise ZKClientError("handle %d invalid path order %s" % (handle, path))
         CountingWatcher.__call__(self, handle, typ, state, path)
 
-class Callback(object):
+class NotificationLatencies(object):
+    """Time from the delete of a znode to each notification of a watch
+    on it, shared by the watchers of a test"""
     def __init__(self):
-        self.cv = threading.Condition()
-        self.callback_flag = False
-        self.rc = -1
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.latencies = LatencyHistogram()
+        self.count = 0
+        # time of the first delete and of the last notification
+        self.first = None
+        self.last = None
+
+    def deleting(self, path):
+        """note the time path is deleted, returns path"""
+        self.sent[path] = now = clock.now()
+        if self.first is None:
+            self.first = now
+        return path
+
+    def notified(self, path):
+        now = clock.now()
+        self.lock.acquire()
+        sent = self.sent.get(path)
+        if sent is not None:
+            self.latencies.record_seconds(now - sent)
+        self.count += 1
+        self.last = now
+        self.lock.release()
+
+    def rate(self):
+        """notifications/sec from the first delete to the last notification"""
+        if not self.count:
+            return 0.0
+        return self.count / max(self.last - self.first, 1e-9)
+
+class TimedWatcher(CountingWatcher):
+    """Counting watcher recording the latency of its notifications in
+    a NotificationLatencies"""
+    def __init__(self, notifications):
+        CountingWatcher.__init__(self)
+        self.notifications = notifications
+
+    def __call__(self, handle, typ, state, path):
+        # recorded first, the waiters go on once the count is reached
+        self.notifications.notified(path)
+        CountingWatcher.__call__(self, handle, typ, state, path)
+
+class CompletionGroup(object):
+    """Completion of a group of asynchronous requests
+
+    The requests of the group share one counter and one condition,
+    instead of a condition per request, and the completions only
+    notify the condition when the waiter can go on. The submitting
+    thread counts its requests with add(), their completions call
+    done(), from any thread.
+    """
+    def __init__(self):
+        self.cv = threading.Condition(threading.Lock())
+        self.submitted = 0
+        self.completed = 0
+        self.failed = None
+        # pending count the waiter is waiting for, None when no one waits
+        self.waiting = None
 
-    def callback(self, handle, rc, handler):
+    def add(self, count=1):
+        self.submitted += count
+
+    def pending(self):
+        return self.submitted - self.completed
+
+    def done(self, callback=None):
         self.cv.acquire()
-        self.callback_flag = True
-        self.handle = handle
-        self.rc = rc
-        handler()
-        self.cv.notify()
+        self.completed += 1
+        if (callback is not None and callback.rc != zookeeper.OK and
+            self.failed is None):
+            self.failed = callback
+        if (self.waiting is not None and
+            self.submitted - self.completed <= self.waiting):
+            self.cv.notify()
         self.cv.release()
 
-    def waitForSuccess(self):
-        while not self.callback_flag:
-            self.cv.wait()
+    def wait(self, pending=0, timeout=None):
+        """Wait until at most pending requests are in flight, returns
+        False if timeout seconds went by first"""
+        self.cv.acquire()
+        self.waiting = pending
+        if timeout is not None:
+            deadline = clock.now() + timeout
+        while self.submitted - self.completed > pending:
+            if timeout is None:
+                self.cv.wait()
+                continue
+            remaining = deadline - clock.now()
+            if remaining <= 0:
+                break
+            self.cv.wait(remaining)
+        self.waiting = None
+        ok = self.submitted - self.completed <= pending
         self.cv.release()
-
-        if not self.callback_flag == True:
-            raise ZKClientError("asynchronous operation timed out on handle %d" %
-                             (self.handle))
-        if not self.rc == zookeeper.OK:
+        return ok
+
+    def waitForSuccess(self, timeout=None):
+        """Wait for every request, raises if one failed"""
+        if not self.wait(0, timeout):
+            raise ZKClientError("%d asynchronous operations timed out" %
+                                (self.pending()))
+        if self.failed is not None:
             raise ZKClientError(
                 "asynchronous operation failed on handle %d with rc %d" %
-                (self.handle, self.rc))
+                (self.failed.handle, self.failed.rc))
+
+class Callback(object):
+    """Result of an asynchronous request, completed into group
+
+    A callback is counted in its group when created, right before its
+    request is submitted. Without a group it is a group of its own.
+    """
+    __slots__ = ('group', 'handle', 'rc', 'submitted', 'completed')
+
+    def __init__(self, group=None):
+        if group is None:
+            group = CompletionGroup()
+        self.group = group
+        self.handle = None
+        self.rc = -1
+        self.submitted = clock.now()
+        self.completed = None
+        group.add()
+
+    @property
+    def callback_flag(self):
+        return self.completed is not None
+
+    def callback(self, handle, rc):
+        """the result is stored before this is called"""
+        self.completed = clock.now()
+        self.handle = handle
+        self.rc = rc
+        self.group.done(self)
+
+    def waitForSuccess(self, timeout=None):
+        """Wait for the whole group of the callback"""
+        self.group.waitForSuccess(timeout)
+
+    def latency(self):
+        """seconds from submit to completion"""
+        return self.completed - self.submitted
 
 
 class GetCallback(Callback):
-    def __init__(self):
-        Callback.__init__(self)
+    __slots__ = ('value', 'stat')
 
     def __call__(self, handle, rc, value, stat):
-        def handler():
-            self.value = value
-            self.stat = stat
-        self.callback(handle, rc, handler)
+        self.value = value
+        self.stat = stat
+        self.callback(handle, rc)
 
 class SetCallback(Callback):
-    def __init__(self):
-        Callback.__init__(self)
+    __slots__ = ('stat',)
 
     def __call__(self, handle, rc, stat):
-        def handler():
-            self.stat = stat
-        self.callback(handle, rc, handler)
+        self.stat = stat
+        self.callback(handle, rc)
 
 class ExistsCallback(SetCallback):
-    pass
+    __slots__ = ()
 
 class CreateCallback(Callback):
-    def __init__(self):
-        Callback.__init__(self)
+    __slots__ = ('path',)
 
     def __call__(self, handle, rc, path):
-        def handler():
-            self.path = path
-        self.callback(handle, rc, handler)
+        self.path = path
+        self.callback(handle, rc)
 
 class DeleteCallback(Callback):
-    def __init__(self):
-        Callback.__init__(self)
+    __slots__ = ()
 
     def __call__(self, handle, rc):
-        def handler():
-            pass
-        self.callback(handle, rc, handler)
+        self.callback(handle, rc)
+
+class MultiCallback(Callback):
+    __slots__ = ('results',)
+
+    def __call__(self, handle, rc, results):
+        self.results = results
+        self.callback(handle, rc)
+
+class Schedule(object):
+    """Send times of an open loop workload, rate requests/sec either
+    evenly spaced or as a Poisson process"""
+    def __init__(self, rate, poisson=False):
+        self.rate = float(rate)
+        self.poisson = poisson
+        self.random = random.Random()
+
+    def offsets(self, count):
+        """time in seconds from the start of each of count sends"""
+        if not self.poisson:
+            return [j / self.rate for j in xrange(count)]
+        offsets = []
+        t = 0.0
+        for j in xrange(count):
+            offsets.append(t)
+            t += self.random.expovariate(self.rate)
+        return offsets
+
+class Pipeline(object):
+    """Drives a batch of asynchronous requests with at most
+    max_outstanding of them in flight (0 for no limit)
+
+    All the requests of a run are counted in one CompletionGroup
+    instead of a Callback per request.
+
+    With a Schedule the requests are sent open loop at its times
+    rather than as fast as possible. Their latency is then measured
+    from the intended send time, so a late send counts against the
+    request instead of being hidden (coordinated omission).
+    """
+    def __init__(self, max_outstanding=0, schedule=None):
+        self.max_outstanding = max_outstanding
+        self.schedule = schedule
+
+    def run(self, count, submit, check=None, latencies=None, lags=None,
+            kinds=None, on_error=None):
+        """Issue count requests, submit(j, completion) sends request j
+        with completion as its callback. check(j, *result) verifies the
+        result of request j, latencies is a LatencyHistogram. lags is a
+        LatencyHistogram of how late each request was sent on the
+        schedule.
+
+        With kinds, latencies is a list of histograms and the latency
+        of request j goes to latencies[kinds[j]].
+
+        A request failing with rc fails the run unless on_error(j, rc)
+        returns True.
+        """
+        self.on_error = on_error
+        self.group = group = CompletionGroup()
+        self.error = None
+        window = self.max_outstanding
+        offsets = self.schedule and self.schedule.offsets(count)
+        begin = clock.now()
+
+        for j in xrange(count):
+            if window and group.pending() >= window:
+                group.wait(window - 1)
+            histogram = latencies
+            if kinds is not None:
+                histogram = latencies[kinds[j]]
+            if offsets:
+                intended = begin + offsets[j]
+                now = clock.now()
+                if now < intended:
+                    time.sleep(intended - now)
+                    now = clock.now()
+                if lags is not None:
+                    lags.record_seconds(now - intended)
+                group.add()
+                submit(j, self.completion(j, check, histogram, intended))
+            else:
+                group.add()
+                submit(j, self.completion(j, check, histogram))
+        group.wait()
+
+        if self.error:
+            raise self.error
+
+    def completion(self, j, check, latencies, start=None):
+        if start is None:
+            start = clock.now()
+        group = self.group
+        def completion(handle, rc, *result):
+            # whatever fails here, the request is counted so the run
+            # raises the error instead of waiting for it forever
+            try:
+                if latencies is not None:
+                    latencies.record_seconds(clock.now() - start, start)
+                if rc != zookeeper.OK:
+                    if not (self.on_error and self.on_error(j, rc)):
+                        self.fail(ZKClientError(
+                            "asynchronous operation %d failed on handle %d with rc %d" %
+                            (j, handle, rc)))
+                elif check:
+                    check(j, *result)
+            except Exception, e:
+                self.fail(e)
+            finally:
+                group.done()
+        return completion
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+
+class BulkDelete(object):
+    """Deletes whole trees with asynchronous deletes, at most
+    max_outstanding of them in flight
+
+    The children of a znode are listed once and deleted page_size at a
+    time, ZooKeeper can't list them in pages, so that at least the
+    requests and callbacks of a huge listing don't pile up. Children
+    are deleted optimistically, those turning out to have children of
+    their own (NOTEMPTY) are deleted recursively after their page. With
+    progress set the count and rate of deletions are printed every
+    interval seconds.
+    """
+    def __init__(self, client, max_outstanding=1000, page_size=10000,
+                 progress=False, interval=1.0):
+        self.client = client
+        self.pipeline = Pipeline(max_outstanding)
+        self.page_size = page_size
+        self.progress = progress
+        self.interval = interval
+        self.deleted = 0
+        self.start = None
+        self.last = None
+
+    def delete(self, path, keep_root=False):
+        """Delete path and everything under it, returns the number of
+        znodes deleted"""
+        if self.start is None:
+            self.start = self.last = clock.now()
+        self.delete_children(path)
+        if not keep_root:
+            try:
+                self.client.delete(path)
+                self.deleted += 1
+            except zookeeper.NoNodeException:
+                pass
+        return self.deleted
+
+    def delete_children(self, path):
+        try:
+            children = self.client.get_children(path)
+        except zookeeper.NoNodeException:
+            return
+
+        prefix = path.rstrip("/") + "/"
+        for first in xrange(0, len(children), self.page_size):
+            page = children[first:first + self.page_size]
+            nonempty = []
+
+            def deleted(j):
+                self.deleted += 1
+                if self.progress and clock.now() - self.last >= self.interval:
+                    self.report()
+
+            def failed(j, rc):
+                if rc == zookeeper.NOTEMPTY:
+                    nonempty.append(page[j])
+                    return True
+                # deleted by someone else
+                return rc == zookeeper.NONODE
+
+            self.pipeline.run(len(page),
+                              lambda j, cb: self.client.adelete(prefix + page[j], cb),
+                              deleted, on_error=failed)
+            for child in nonempty:
+                self.delete(prefix + child)
+
+    def rate(self):
+        return self.deleted / max(clock.now() - self.start, 1e-9)
+
+    def report(self):
+        self.last = clock.now()
+        print("deleted %7d znodes in %6d ms (%f/sec)" %
+              (self.deleted, int((self.last - self.start) * 1000), self.rate()))
+
+class Barrier(object):
+    """Blocks the threads calling wait() until parties of them do,
+    threading.Barrier is not in python 2"""
+    def __init__(self, parties):
+        self.parties = parties
+        self.count = 0
+        self.generation = 0
+        self.cv = threading.Condition()
+
+    def wait(self):
+        self.cv.acquire()
+        generation = self.generation
+        self.count += 1
+        if self.count == self.parties:
+            self.count = 0
+            self.generation += 1
+            self.cv.notifyAll()
+        else:
+            while generation == self.generation:
+                self.cv.wait()
+        self.cv.release()
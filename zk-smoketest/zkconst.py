@@ -0,0 +1,107 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Constants and exceptions of the zookeeper binding, for the backends
+standing in for it"""
+
+OK = 0
+SYSTEMERROR = -1
+CONNECTIONLOSS = -4
+APIERROR = -100
+NONODE = -101
+NOAUTH = -102
+BADVERSION = -103
+NOCHILDRENFOREPHEMERALS = -108
+NODEEXISTS = -110
+NOTEMPTY = -111
+SESSIONEXPIRED = -112
+INVALIDSTATE = -9
+
+EPHEMERAL = 1
+SEQUENCE = 2
+
+CREATED_EVENT = 1
+DELETED_EVENT = 2
+CHANGED_EVENT = 3
+CHILD_EVENT = 4
+SESSION_EVENT = -1
+NOTWATCHING_EVENT = -2
+
+EXPIRED_SESSION_STATE = -112
+AUTH_FAILED_STATE = -113
+CONNECTING_STATE = 1
+ASSOCIATING_STATE = 2
+CONNECTED_STATE = 3
+
+PERM_READ = 1
+PERM_WRITE = 2
+PERM_CREATE = 4
+PERM_DELETE = 8
+PERM_ADMIN = 16
+PERM_ALL = 31
+
+class ZooKeeperException(Exception):
+    pass
+
+class SystemErrorException(ZooKeeperException):
+    pass
+
+class ConnectionLossException(ZooKeeperException):
+    pass
+
+class ApiErrorException(ZooKeeperException):
+    pass
+
+class NoNodeException(ZooKeeperException):
+    pass
+
+class NoAuthException(ZooKeeperException):
+    pass
+
+class BadVersionException(ZooKeeperException):
+    pass
+
+class NoChildrenForEphemeralsException(ZooKeeperException):
+    pass
+
+class NodeExistsException(ZooKeeperException):
+    pass
+
+class NotEmptyException(ZooKeeperException):
+    pass
+
+class SessionExpiredException(ZooKeeperException):
+    pass
+
+class InvalidStateException(ZooKeeperException):
+    pass
+
+EXCEPTIONS = {
+    SYSTEMERROR: SystemErrorException,
+    CONNECTIONLOSS: ConnectionLossException,
+    APIERROR: ApiErrorException,
+    NONODE: NoNodeException,
+    NOAUTH: NoAuthException,
+    BADVERSION: BadVersionException,
+    NOCHILDRENFOREPHEMERALS: NoChildrenForEphemeralsException,
+    NODEEXISTS: NodeExistsException,
+    NOTEMPTY: NotEmptyException,
+    SESSIONEXPIRED: SessionExpiredException,
+    INVALIDSTATE: InvalidStateException,
+}
+
+def err_to_exception(rc):
+    return EXCEPTIONS.get(rc, ZooKeeperException)("error %d" % (rc))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local stand-in ZooKeeper server
+
+Speaks the part of the wire protocol zkwire uses, on the in-memory tree
+of fakezk: each connection is a fakezk session, which applies its
+requests in order after the injected latency and writes the replies
+and watch notifications from its own thread. Unlike the fake backend
+it can be shared by processes, e.g. zk-latencies.py --processes.
+
+    ./zkserver.py --port 2181 --latency 1
+"""
+
+import socket, threading
+from optparse import OptionParser
+
+import fakezk
+from zkconst import *
+from zkwire import Frames, frame, pack_buffer, unpack_buffer, pack_stat, \
+    unpack_acl, INT, REQUEST_HEADER, REPLY_HEADER, CONNECT_REQUEST, \
+    CONNECT_RESPONSE, WATCHER_EVENT, WATCHER_EVENT_XID, READ_SIZE, \
+    CREATE_OP, DELETE_OP, EXISTS_OP, GETDATA_OP, SETDATA_OP, \
+    GETCHILDREN_OP, SYNC_OP, PING_OP, CLOSE_OP
+
+def encode_path(path):
+    return pack_buffer(path)
+
+def encode_stat(stat):
+    return pack_stat(stat)
+
+def encode_data(value, stat):
+    return pack_buffer(value) + pack_stat(stat)
+
+def encode_children(children):
+    return INT.pack(len(children)) + "".join(pack_buffer(c) for c in children)
+
+def encode_nothing(*values):
+    return ""
+
+class ServerConnection(object):
+    """A client connection and its fakezk session"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.frames = Frames()
+        self.handle = None
+        self.closing = False
+
+    def send(self, packet):
+        try:
+            self.sock.sendall(frame(packet))
+        except socket.error:
+            pass
+
+    def reply(self, xid, encode):
+        """completion writing the reply to request xid"""
+        def completion(handle, rc, *values):
+            body = rc == OK and encode(*values) or ""
+            self.send(REPLY_HEADER.pack(xid, fakezk.tree.zxid, rc) + body)
+        return completion
+
+    def notify(self, handle, typ, state, path):
+        self.send(REPLY_HEADER.pack(WATCHER_EVENT_XID, -1, OK) +
+                  WATCHER_EVENT.pack(typ, state) + pack_buffer(path))
+
+    def run(self):
+        try:
+            packets = []
+            while not packets:
+                data = self.sock.recv(READ_SIZE)
+                if not data:
+                    return
+                packets = self.frames.feed(data)
+            version, zxid, timeout, session_id = \
+                CONNECT_REQUEST.unpack_from(packets[0], 0)
+            self.handle = fakezk.init("stand-in")
+            self.session = fakezk.sessions[self.handle]
+            self.send(CONNECT_RESPONSE.pack(0, timeout, self.handle) +
+                      pack_buffer("\0" * 16))
+
+            for packet in packets[1:]:
+                self.request(packet)
+            while not self.closing:
+                data = self.sock.recv(READ_SIZE)
+                if not data:
+                    break
+                for packet in self.frames.feed(data):
+                    self.request(packet)
+        except socket.error:
+            pass
+        finally:
+            if self.handle is not None:
+                fakezk.close(self.handle)
+            self.sock.close()
+
+    def request(self, packet):
+        xid, op = REQUEST_HEADER.unpack_from(packet, 0)
+        offset = REQUEST_HEADER.size
+        tree = fakezk.tree
+        submit = self.session.submit
+        if op == PING_OP:
+            submit(lambda s: OK, (), self.reply(xid, encode_nothing))
+        elif op == CREATE_OP:
+            path, offset = unpack_buffer(packet, offset)
+            value, offset = unpack_buffer(packet, offset)
+            acl, offset = unpack_acl(packet, offset)
+            flags, = INT.unpack_from(packet, offset)
+            submit(tree.create, (path, value or "", flags),
+                   self.reply(xid, encode_path))
+        elif op == DELETE_OP:
+            path, offset = unpack_buffer(packet, offset)
+            version, = INT.unpack_from(packet, offset)
+            submit(tree.delete, (path, version), self.reply(xid, encode_nothing))
+        elif op in (EXISTS_OP, GETDATA_OP, GETCHILDREN_OP):
+            path, offset = unpack_buffer(packet, offset)
+            watcher = packet[offset] != "\0" and self.notify or None
+            if op == EXISTS_OP:
+                submit(tree.exists, (path, watcher), self.reply(xid, encode_stat))
+            elif op == GETDATA_OP:
+                submit(tree.get, (path, watcher), self.reply(xid, encode_data))
+            else:
+                submit(tree.get_children, (path, watcher),
+                       self.reply(xid, encode_children))
+        elif op == SETDATA_OP:
+            path, offset = unpack_buffer(packet, offset)
+            value, offset = unpack_buffer(packet, offset)
+            version, = INT.unpack_from(packet, offset)
+            submit(tree.set, (path, value or "", version),
+                   self.reply(xid, encode_stat))
+        elif op == SYNC_OP:
+            path, offset = unpack_buffer(packet, offset)
+            submit(lambda s: (OK, path), (), self.reply(xid, encode_path))
+        elif op == CLOSE_OP:
+            self.closing = True
+            submit(lambda s: OK, (), self.reply(xid, encode_nothing))
+        else:
+            submit(lambda s: APIERROR, (), self.reply(xid, encode_nothing))
+
+class StandInServer(object):
+    """Accepts connections on host:port, port 0 picks a free one"""
+    def __init__(self, host="127.0.0.1", port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(128)
+        self.address = "%s:%d" % self.sock.getsockname()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       name="zkserver")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        while True:
+            try:
+                sock, address = self.sock.accept()
+            except socket.error:
+                return
+            t = threading.Thread(target=ServerConnection(sock).run)
+            t.daemon = True
+            t.start()
+
+    def stop(self):
+        self.sock.close()
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("", "--host", dest="host", default="127.0.0.1",
+                      help="address to listen on (default %default)")
+    parser.add_option("", "--port", dest="port", type="int", default=2181,
+                      help="port to listen on (default %default)")
+    parser.add_option("", "--latency", dest="latency", type="float",
+                      default=None, help="latency in ms added to each request (default $FAKEZK_LATENCY_MS or 0)")
+    (options, args) = parser.parse_args()
+
+    if options.latency is not None:
+        fakezk.set_latency(options.latency)
+    server = StandInServer(options.host, options.port)
+    print("serving on %s" % (server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,457 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pure python client of the ZooKeeper wire protocol
+
+Implements the part of the zookeeper module used by zkclient over one
+socket per handle. Requests are written as soon as they are submitted,
+so any number of them are pipelined, and a reader thread matches the
+replies, which come back in order, with the queue of pending requests
+and runs their completions and the watchers. There is no lock or
+condition per request, only the sync calls wait on one.
+"""
+
+import sys, socket, struct, select, threading, collections, time, errno, traceback
+
+from zkconst import *
+
+# request types
+NOTIFICATION_OP = 0
+CREATE_OP = 1
+DELETE_OP = 2
+EXISTS_OP = 3
+GETDATA_OP = 4
+SETDATA_OP = 5
+SYNC_OP = 9
+PING_OP = 11
+GETCHILDREN_OP = 8
+CLOSE_OP = -11
+
+# reserved xids
+WATCHER_EVENT_XID = -1
+PING_XID = -2
+
+INT = struct.Struct(">i")
+LONG = struct.Struct(">q")
+REQUEST_HEADER = struct.Struct(">ii")
+REPLY_HEADER = struct.Struct(">iqi")
+CONNECT_REQUEST = struct.Struct(">iqiq")
+CONNECT_RESPONSE = struct.Struct(">iiq")
+STAT = struct.Struct(">qqqqiiiqiiq")
+STAT_FIELDS = ('czxid', 'mzxid', 'ctime', 'mtime', 'version', 'cversion',
+               'aversion', 'ephemeralOwner', 'dataLength', 'numChildren',
+               'pzxid')
+WATCHER_EVENT = struct.Struct(">ii")
+
+READ_SIZE = 1 << 16
+
+def pack_buffer(value):
+    if value is None:
+        return INT.pack(-1)
+    return INT.pack(len(value)) + value
+
+def unpack_buffer(data, offset):
+    length, = INT.unpack_from(data, offset)
+    offset += 4
+    if length < 0:
+        return None, offset
+    return data[offset:offset + length], offset + length
+
+def pack_stat(stat):
+    return STAT.pack(*[stat[f] for f in STAT_FIELDS])
+
+def unpack_stat(data, offset):
+    return dict(zip(STAT_FIELDS, STAT.unpack_from(data, offset))), offset + STAT.size
+
+def pack_acl(acl):
+    return INT.pack(len(acl)) + "".join(
+        INT.pack(a["perms"]) + pack_buffer(a["scheme"]) + pack_buffer(a["id"])
+        for a in acl)
+
+def unpack_acl(data, offset):
+    count, = INT.unpack_from(data, offset)
+    offset += 4
+    acl = []
+    for i in xrange(count):
+        perms, = INT.unpack_from(data, offset)
+        scheme, offset = unpack_buffer(data, offset + 4)
+        id, offset = unpack_buffer(data, offset)
+        acl.append({"perms": perms, "scheme": scheme, "id": id})
+    return acl, offset
+
+def unpack_strings(data, offset):
+    count, = INT.unpack_from(data, offset)
+    offset += 4
+    strings = []
+    for i in xrange(count):
+        s, offset = unpack_buffer(data, offset)
+        strings.append(s)
+    return strings, offset
+
+def frame(payload):
+    return INT.pack(len(payload)) + payload
+
+class Frames(object):
+    """Splits the length prefixed packets out of a stream"""
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, data):
+        buffer = self.buffer + data
+        offset = 0
+        packets = []
+        while len(buffer) - offset >= 4:
+            length, = INT.unpack_from(buffer, offset)
+            if len(buffer) - offset - 4 < length:
+                break
+            packets.append(buffer[offset + 4:offset + 4 + length])
+            offset += 4 + length
+        self.buffer = buffer[offset:]
+        return packets
+
+# result of a failed request, by type
+EMPTY_RESULTS = {CREATE_OP: (None,), DELETE_OP: (), EXISTS_OP: (None,),
+                 GETDATA_OP: (None, None), SETDATA_OP: (None,),
+                 GETCHILDREN_OP: (None,), SYNC_OP: (None,), CLOSE_OP: ()}
+
+def decode(op, body):
+    if op == CREATE_OP or op == SYNC_OP:
+        return (unpack_buffer(body, 0)[0],)
+    elif op == EXISTS_OP or op == SETDATA_OP:
+        return (unpack_stat(body, 0)[0],)
+    elif op == GETDATA_OP:
+        value, offset = unpack_buffer(body, 0)
+        return (value, unpack_stat(body, offset)[0])
+    elif op == GETCHILDREN_OP:
+        return (unpack_strings(body, 0)[0],)
+    return ()
+
+def connect(hosts, timeout):
+    """socket to the first of the comma separated host:port answering"""
+    error = None
+    for host in hosts.split(","):
+        address, port = host.rsplit(":", 1)
+        try:
+            return socket.create_connection((address, int(port)), timeout)
+        except socket.error, e:
+            error = e
+    raise ConnectionLossException("unable to connect to %s: %s" % (hosts, error))
+
+class Connection(object):
+    """A session, its socket and the thread reading the replies"""
+    def __init__(self, handle, hosts, watcher, recv_timeout):
+        self.handle = handle
+        self.watcher = watcher
+        self.sock = connect(hosts, recv_timeout / 1000.0)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.frames = Frames()
+
+        self.sock.sendall(frame(CONNECT_REQUEST.pack(0, 0, recv_timeout, 0) +
+                                pack_buffer("\0" * 16)))
+        response = []
+        while not response:
+            data = self.sock.recv(READ_SIZE)
+            if not data:
+                raise ConnectionLossException("connection to %s closed" % (hosts))
+            response = self.frames.feed(data)
+        version, self.timeout, self.session_id = \
+            CONNECT_RESPONSE.unpack_from(response[0], 0)
+        if self.timeout <= 0:
+            raise SessionExpiredException("session to %s expired" % (hosts))
+        self.sock.settimeout(None)
+
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.xid = 0
+        self.closed = False
+        self.last_send = time.time()
+        self.data_watches = collections.defaultdict(list)
+        self.exist_watches = collections.defaultdict(list)
+        self.child_watches = collections.defaultdict(list)
+
+        self.thread = threading.Thread(target=self.run,
+                                       name="zkwire-%d" % (handle))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, op, payload, completion, watch=None):
+        """Send a request, completion(handle, rc, *result) is called by
+        the reader thread with its reply. watch is (watches, path,
+        watcher), registered once the reply says the watch is set."""
+        self.lock.acquire()
+        try:
+            if self.closed:
+                raise InvalidStateException("handle %d is closed" % (self.handle))
+            self.xid += 1
+            self.pending.append((self.xid, op, completion, watch))
+            self.sock.sendall(frame(REQUEST_HEADER.pack(self.xid, op) + payload))
+            self.last_send = time.time()
+        finally:
+            self.lock.release()
+
+    def ping(self):
+        """called by the reader thread, which must not wait for a submit
+        blocked in sendall: the server stops reading while its replies
+        are not read. A submit in progress keeps the session alive, so
+        the ping is skipped then."""
+        if not self.lock.acquire(False):
+            return
+        try:
+            self.sock.sendall(frame(REQUEST_HEADER.pack(PING_XID, PING_OP)))
+            self.last_send = time.time()
+        finally:
+            self.lock.release()
+
+    def call(self, callback, *args):
+        """run a completion or watcher, an error is logged like the
+        native binding does instead of ending the reader thread"""
+        try:
+            callback(*args)
+        except Exception:
+            log_stream.write("zkwire: callback %r failed on handle %d\n" %
+                             (callback, self.handle))
+            traceback.print_exc(file=log_stream)
+
+    def run(self):
+        if self.watcher is not None:
+            self.call(self.watcher, self.handle, SESSION_EVENT, CONNECTED_STATE, "")
+        interval = self.timeout / 3000.0
+        try:
+            while True:
+                # ping when nothing was sent for interval, even while
+                # replies and events keep coming in
+                wait = interval - (time.time() - self.last_send)
+                if wait <= 0:
+                    self.ping()
+                    wait = interval
+                readable = select.select([self.sock], [], [], wait)[0]
+                if not readable:
+                    continue
+                data = self.sock.recv(READ_SIZE)
+                if not data:
+                    break
+                for packet in self.frames.feed(data):
+                    if self.reply(packet):
+                        return
+        except (socket.error, select.error), e:
+            if not self.closed:
+                raise
+        finally:
+            # a submit blocked in sendall fails once the socket is shut
+            # down, releasing the lock fail() takes
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.fail(CONNECTIONLOSS)
+            self.sock.close()
+
+    def reply(self, packet):
+        """handle a reply, returns True for the one closing the session"""
+        xid, zxid, rc = REPLY_HEADER.unpack_from(packet, 0)
+        body = packet[REPLY_HEADER.size:]
+        if xid == WATCHER_EVENT_XID:
+            self.event(body)
+            return False
+        if xid == PING_XID:
+            return False
+
+        expected, op, completion, watch = self.pending.popleft()
+        if xid != expected:
+            raise ZooKeeperException("reply %d to request %d" % (xid, expected))
+        if rc == OK:
+            result = decode(op, body)
+        else:
+            result = EMPTY_RESULTS[op]
+        if watch is not None:
+            watches, path, watcher = watch
+            if rc == OK or (op == EXISTS_OP and rc == NONODE):
+                if rc == NONODE:
+                    watches = self.exist_watches
+                if watcher not in watches[path]:
+                    watches[path].append(watcher)
+        if completion is not None:
+            self.call(completion, self.handle, rc, *result)
+        return op == CLOSE_OP
+
+    def event(self, body):
+        typ, state = WATCHER_EVENT.unpack_from(body, 0)
+        path = unpack_buffer(body, WATCHER_EVENT.size)[0]
+        watchers = []
+        if typ in (CREATED_EVENT, CHANGED_EVENT, DELETED_EVENT):
+            watchers += self.data_watches.pop(path, [])
+            watchers += self.exist_watches.pop(path, [])
+        if typ in (CHILD_EVENT, DELETED_EVENT):
+            watchers += self.child_watches.pop(path, [])
+        for watcher in watchers:
+            self.call(watcher, self.handle, typ, state, path)
+
+    def fail(self, rc):
+        """complete what is still pending with rc"""
+        # under the lock, so nothing is submitted after the draining
+        self.lock.acquire()
+        self.closed = True
+        self.lock.release()
+        while self.pending:
+            xid, op, completion, watch = self.pending.popleft()
+            if completion is not None:
+                self.call(completion, self.handle, rc, *EMPTY_RESULTS[op])
+
+    def close(self):
+        done = threading.Event()
+        try:
+            self.submit(CLOSE_OP, "", lambda h, rc: done.set())
+        except (InvalidStateException, socket.error):
+            pass
+        else:
+            if threading.current_thread() is not self.thread:
+                done.wait(self.timeout / 1000.0)
+        self.closed = True
+        self.sock.close()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
+
+connections = {}
+next_handle = [0]
+handle_lock = threading.Lock()
+
+def connection(handle):
+    try:
+        return connections[handle]
+    except KeyError:
+        raise InvalidStateException("no handle %d" % (handle))
+
+# where the errors of the callbacks are reported
+log_stream = sys.stderr
+
+def set_log_stream(stream):
+    global log_stream
+    log_stream = stream
+
+def set_debug_level(level):
+    pass
+
+def init(host, watcher=None, recv_timeout=10000, client_id=None):
+    handle_lock.acquire()
+    handle = next_handle[0]
+    next_handle[0] += 1
+    handle_lock.release()
+    connections[handle] = Connection(handle, host, watcher, recv_timeout)
+    return handle
+
+def close(handle):
+    connection(handle).close()
+    del connections[handle]
+    return OK
+
+def state(handle):
+    if connection(handle).closed:
+        return CONNECTING_STATE
+    return CONNECTED_STATE
+
+def wait_for(handle, op, payload, watch=None):
+    """Send a request and wait for its reply"""
+    conn = connection(handle)
+    if threading.current_thread() is conn.thread:
+        raise ApiErrorException("sync call from a completion")
+    done = threading.Event()
+    result = []
+    def completion(h, rc, *values):
+        result.append(rc)
+        result.extend(values)
+        done.set()
+    conn.submit(op, payload, completion, watch)
+    done.wait()
+    if result[0] != OK:
+        raise err_to_exception(result[0])
+    return result[1:]
+
+def path_request(path, watcher):
+    return pack_buffer(path) + (watcher is not None and "\1" or "\0")
+
+def watch(handle, kind, path, watcher):
+    if watcher is None:
+        return None
+    return (getattr(connection(handle), kind), path, watcher)
+
+def create_request(path, value, acl, flags):
+    return pack_buffer(path) + pack_buffer(value) + pack_acl(acl) + INT.pack(flags)
+
+def create(handle, path, value, acl, flags=0):
+    return wait_for(handle, CREATE_OP, create_request(path, value, acl, flags))[0]
+
+def delete(handle, path, version=-1):
+    wait_for(handle, DELETE_OP, pack_buffer(path) + INT.pack(version))
+    return OK
+
+def get(handle, path, watcher=None, bufferlen=1024*1024):
+    value, stat = wait_for(handle, GETDATA_OP, path_request(path, watcher),
+                           watch(handle, "data_watches", path, watcher))
+    return value, stat
+
+def exists(handle, path, watcher=None):
+    try:
+        return wait_for(handle, EXISTS_OP, path_request(path, watcher),
+                        watch(handle, "data_watches", path, watcher))[0]
+    except NoNodeException:
+        return None
+
+def set(handle, path, value, version=-1):
+    set2(handle, path, value, version)
+    return OK
+
+def set2(handle, path, value, version=-1):
+    return wait_for(handle, SETDATA_OP,
+                    pack_buffer(path) + pack_buffer(value) + INT.pack(version))[0]
+
+def get_children(handle, path, watcher=None):
+    return wait_for(handle, GETCHILDREN_OP, path_request(path, watcher),
+                    watch(handle, "child_watches", path, watcher))[0]
+
+def async(handle, path="/"):
+    wait_for(handle, SYNC_OP, pack_buffer(path))
+    return OK
+
+def acreate(handle, path, value, acl, flags=0, completion=None):
+    connection(handle).submit(CREATE_OP, create_request(path, value, acl, flags),
+                              completion)
+    return OK
+
+def adelete(handle, path, version=-1, completion=None):
+    connection(handle).submit(DELETE_OP, pack_buffer(path) + INT.pack(version),
+                              completion)
+    return OK
+
+def aget(handle, path, watcher=None, completion=None):
+    connection(handle).submit(GETDATA_OP, path_request(path, watcher), completion,
+                              watch(handle, "data_watches", path, watcher))
+    return OK
+
+def aexists(handle, path, watcher=None, completion=None):
+    connection(handle).submit(EXISTS_OP, path_request(path, watcher), completion,
+                              watch(handle, "data_watches", path, watcher))
+    return OK
+
+def aset(handle, path, value, version=-1, completion=None):
+    connection(handle).submit(SETDATA_OP,
+                              pack_buffer(path) + pack_buffer(value) + INT.pack(version),
+                              completion)
+    return OK
+
+def aget_children(handle, path, watcher=None, completion=None):
+    connection(handle).submit(GETCHILDREN_OP, path_request(path, watcher), completion,
+                              watch(handle, "child_watches", path, watcher))
+    return OK